@@ -4,11 +4,12 @@ import os
 import re
 import signal
 import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timezone
+from functools import lru_cache
 from pathlib import Path
 from typing import Any, Dict, Iterable, List, Optional, Tuple
 
-import requests
 from confluent_kafka import Producer
 from confluent_kafka.schema_registry import SchemaRegistryClient
 from confluent_kafka.schema_registry.json_schema import JSONSerializer
@@ -18,8 +19,44 @@ from resilience import (
     ResilientProducer,
     RetryConfig,
     http_request_with_retry,
+    make_http_session,
 )
 
+# orjson when available (bytes in/out, native code); stdlib json otherwise
+try:
+    import orjson
+
+    _json_dumps = orjson.dumps
+    _json_loads = orjson.loads
+
+    def _json_dumps_sorted(obj: Any) -> bytes:
+        return orjson.dumps(obj, option=orjson.OPT_SORT_KEYS)
+except ImportError:
+
+    def _json_dumps(obj: Any) -> bytes:
+        return json.dumps(obj).encode("utf-8")
+
+    _json_loads = json.loads
+
+    def _json_dumps_sorted(obj: Any) -> bytes:
+        return json.dumps(obj, sort_keys=True, separators=(",", ":")).encode("utf-8")
+
+
+# Non-cryptographic digest for change detection: xxh3-128 (32 hex chars), SHA1 (40) as fallback.
+# FP_VERSION names digest and payload encoding; saved fingerprints from any other version are dropped.
+try:
+    import xxhash
+
+    _hexdigest = xxhash.xxh3_128_hexdigest
+    FP_VERSION = "xxh3_128-json"
+except ImportError:
+
+    def _hexdigest(data: bytes) -> str:
+        return hashlib.sha1(data).hexdigest()
+
+    FP_VERSION = "sha1-json"
+
+
 # --------- env ---------
 BASE1 = os.getenv("VLC_EXPLORE_BASE", "https://valencia.opendatasoft.com/api/explore/v2.1")
 BASE2 = os.getenv("VLC_EXPLORE_BASE2", "https://valencia.opendatasoft.com/api/v2")
@@ -32,6 +69,11 @@ SCHEMA_REGISTRY_URL = os.getenv("SCHEMA_REGISTRY_URL", "http://schema-registry:8
 POLL_SECS = int(os.getenv("POLL_EVERY_SECONDS", "300"))
 LIMIT = int(os.getenv("PAGE_LIMIT", "100"))
 
+# End-of-batch drain: poll in short slices so a stop signal is noticed, giving up after FLUSH_TIMEOUT_SECS
+# Floored at 10ms: 0 would busy-spin poll(0) and a negative value would make poll() block indefinitely
+FLUSH_POLL_INTERVAL_MS = max(10, int(os.getenv("FLUSH_POLL_INTERVAL_MS", "500")))
+FLUSH_TIMEOUT_SECS = 30.0
+
 # Loading JSON schema for Schema Registry
 SCHEMA_PATH = Path(__file__).parent / "schemas" / "air.json"
 with open(SCHEMA_PATH, "r", encoding="utf-8") as f:
@@ -70,11 +112,14 @@ DESIRED_FIELDS = [
 ]
 
 # Which fields define a change if ts is the same?
-CHANGE_FIELDS = ["so2", "no2", "o3", "co", "pm10", "pm25"]
+CHANGE_FIELDS = ("so2", "no2", "o3", "co", "pm10", "pm25")
 
-session = requests.Session()
-session.headers.update({"User-Agent": "vlc-python-producer/1.4"})
-session.timeout = (10, 60)  # connect, read
+# Pooled keep-alive connections, reused across pages and both API bases
+session = make_http_session(
+    "vlc-python-producer/1.4",
+    pool_maxsize=int(os.getenv("VLC_HTTP_POOL_SIZE", "4")),
+    timeout=(10, 60),  # connect, read
+)
 
 # Resilience configuration
 RETRY_CONFIG = RetryConfig.from_env()
@@ -123,8 +168,15 @@ def load_state() -> Tuple[str, dict]:
     os.makedirs(STATE_DIR, exist_ok=True)
     if os.path.exists(STATE_JSON):
         try:
-            d = json.load(open(STATE_JSON, "r", encoding="utf-8"))
-            return d.get("offset", START_OFFSET), dict(d.get("seen_for_offset", {}))
+            with open(STATE_JSON, "rb") as f:
+                d = _json_loads(f.read())
+            seen = d.get("seen_for_offset", {})
+            if d.get("fp_version") != FP_VERSION:
+                # Fingerprints in another format never match: start the offset window afresh
+                if seen:
+                    print(f"[air] fingerprint format changed to {FP_VERSION}, discarding seen_for_offset")
+                seen = {}
+            return d.get("offset", START_OFFSET), dict(seen)
         except Exception:
             pass
     # fallback to your old offset.txt if present
@@ -132,20 +184,30 @@ def load_state() -> Tuple[str, dict]:
     return off, {}  # fallback if migrating
 
 
+def _atomic_write(path: str, data: bytes) -> None:
+    """Writes data to a sibling temp file and swaps it in, so a crash never leaves a truncated file."""
+    tmp = f"{path}.tmp"
+    with open(tmp, "wb") as f:
+        f.write(data)
+    os.replace(tmp, path)
+
+
 def save_state(offset_iso: str, seen_map: dict) -> None:
     """Saves the current offset and station → fingerprint map to JSON."""
     os.makedirs(STATE_DIR, exist_ok=True)
-    with open(STATE_JSON, "w", encoding="utf-8") as f:
-        json.dump({"offset": offset_iso, "seen_for_offset": seen_map}, f)
+    state = {"offset": offset_iso, "fp_version": FP_VERSION, "seen_for_offset": seen_map}
+    _atomic_write(STATE_JSON, _json_dumps(state))
 
 
 def save_offset(iso: str) -> None:
     os.makedirs(STATE_DIR, exist_ok=True)
-    with open(OFFSET_FILE, "w", encoding="utf-8") as f:
-        f.write(iso)
+    _atomic_write(OFFSET_FILE, iso.encode("utf-8"))
 
 
-POINT_RX = re.compile(r"POINT\s*\(\s*([-\d\.]+)\s+([-\d\.]+)\s*\)")
+# WKT "POINT (lon lat)"; each group only matches a well-formed decimal, so float() cannot fail on it
+POINT_RX = re.compile(r"POINT\s*\(\s*(-?\d+(?:\.\d+)?)\s+(-?\d+(?:\.\d+)?)\s*\)")
+# UTC timestamps (Z or +00:00, optional subseconds) as served by ODS; group 1 is the part we keep
+UTC_TS_RX = re.compile(r"([0-9]{4}-[0-9]{2}-[0-9]{2}T[0-9]{2}:[0-9]{2}:[0-9]{2})(?:\.[0-9]+)?(?:Z|[+-]00:00)")
 
 
 def extract_lat_lon(geo: Any) -> Tuple[Optional[float], Optional[float]]:
@@ -169,8 +231,16 @@ def extract_lat_lon(geo: Any) -> Tuple[Optional[float], Optional[float]]:
     return (None, None)
 
 
+# Rows in one poll share a handful of sample times, so most calls are cache hits
+@lru_cache(maxsize=1024)
 def normalize_ts(s: str) -> str:
     # Ensure "YYYY-MM-DDTHH:MM:SSZ" (no millis)
+    m = UTC_TS_RX.fullmatch(s)
+    if m:
+        # Already UTC: truncating subseconds is all that's needed once the fields parse as a real date
+        head = m.group(1)
+        datetime.fromisoformat(head)
+        return head + "Z"
     try:
         dt = datetime.fromisoformat(s.replace("Z", "+00:00"))
     except Exception:
@@ -188,8 +258,7 @@ def normalize_ts(s: str) -> str:
 def value_fingerprint(rec: dict) -> str:
     """Creates a fingerprint of the value fields to detect data changes."""
     payload = {k: rec.get(k) for k in CHANGE_FIELDS}
-    s = json.dumps(payload, sort_keys=True, separators=(",", ":"))
-    return hashlib.sha1(s.encode("utf-8")).hexdigest()
+    return _hexdigest(_json_dumps_sorted(payload))
 
 
 def map_record(r: Dict[str, Any], ts_field: str) -> Dict[str, Any]:
@@ -209,17 +278,8 @@ def map_record(r: Dict[str, Any], ts_field: str) -> Dict[str, Any]:
         "lat": lat,
         "lon": lon,
     }
-    # Add fingerprint based on mapped values
-    out["_fp"] = value_fingerprint(
-        {
-            "so2": out["so2"],
-            "no2": out["no2"],
-            "o3": out["o3"],
-            "co": out["co"],
-            "pm10": out["pm10"],
-            "pm25": out["pm25"],
-        }
-    )
+    # Add fingerprint based on mapped values (value_fingerprint projects CHANGE_FIELDS itself)
+    out["_fp"] = value_fingerprint(out)
     return out
 
 
@@ -229,12 +289,18 @@ def produce_all(p: ResilientProducer, events: Iterable[Dict[str, Any]], serializ
     for ev in events:
         if not ev.get("ts"):  # skip malformed rows without timestamp
             continue
-        # Removing internal fingerprint field before sending to Kafka
-        kafka_ev = {k: v for k, v in ev.items() if k != "_fp"}
+        # Removing internal fingerprint field before sending to Kafka (C-level copy, then one delete)
+        kafka_ev = ev.copy()
+        kafka_ev.pop("_fp", None)
         key = f"{ev['fiwareid']}|{ev['ts']}"
         value_bytes = serializer(kafka_ev, ctx)
         p.produce(key=key.encode("utf-8"), value=value_bytes)
-    p.flush()
+    deadline = time.monotonic() + FLUSH_TIMEOUT_SECS
+    interval = FLUSH_POLL_INTERVAL_MS / 1000
+    while running and p.outstanding and time.monotonic() < deadline:
+        p.poll(interval)
+    # Anything still queued after a stop or timeout is moved to the DLQ
+    p.flush(0)
 
 
 # ------------- metadata helpers -------------
@@ -309,6 +375,22 @@ def compute_select(avail_fields: List[str], ts_field: str) -> str:
 
 
 # ------------- fetching loop -------------
+def _fetch_page(base: str, page: int, offset_iso: str, select: str, ts_field: str) -> List[Dict[str, Any]]:
+    """Fetches one page of records at or after offset_iso from a single API base."""
+    params = {
+        "order_by": ts_field,
+        "limit": str(LIMIT),
+        "offset": str(page * LIMIT),
+        "select": select,
+        "where": f"{ts_field}>=date'{offset_iso}'",
+    }
+    resp = http_request_with_retry(
+        session, "GET", f"{base}/catalog/datasets/{DATASET_ID}/records", config=RETRY_CONFIG, params=params
+    )
+    resp.raise_for_status()
+    return resp.json().get("results", [])
+
+
 def fetch_since(
     offset_iso: str, seen_for_offset: dict, bases: List[str], select: str, ts_field: str
 ) -> Tuple[List[Dict[str, Any]], str, dict]:
@@ -322,67 +404,67 @@ def fetch_since(
     out: List[Dict[str, Any]] = []
     max_ts = offset_iso
     seen_map = dict(seen_for_offset)  # copy to track current window
-    for base in bases:
-        page = 0
-        while True:
-            params = {
-                "order_by": ts_field,
-                "limit": str(LIMIT),
-                "offset": str(page * LIMIT),
-                "select": select,
-                "where": f"{ts_field}>=date'{offset_iso}'",
-            }
-            try:
-                resp = http_request_with_retry(
-                    session, "GET", f"{base}/catalog/datasets/{DATASET_ID}/records", config=RETRY_CONFIG, params=params
-                )
-                resp.raise_for_status()
-                rows = resp.json().get("results", [])
-            except Exception:
-                # Try next base if nothing collected yet
-                if not out:
+    # Local aliases: LOAD_FAST instead of LOAD_GLOBAL/attribute lookups in the per-row loop
+    map_rec = map_record
+    seen_for_offset_get = seen_for_offset.get
+    # Bases are failovers for the same dataset, so they stay sequential; within a base the next
+    # page is requested in the background while the current one is deduplicated
+    with ThreadPoolExecutor(max_workers=1) as pool:
+        for base in bases:
+            page = 0
+            pending = pool.submit(_fetch_page, base, page, offset_iso, select, ts_field)
+            while True:
+                try:
+                    rows = pending.result()
+                except Exception:
+                    # Try next base if nothing collected yet
+                    if not out:
+                        break
+                    else:
+                        return out, max_ts, seen_map
+                if not rows:
                     break
-                else:
-                    return out, max_ts, seen_map
-            if not rows:
-                break
-            for r in rows:
-                ev = map_record(r, ts_field)
-                ts = ev.get("ts")
-                sid = ev.get("fiwareid")
-                fp = ev.get("_fp")
-                if not (ts and sid and fp):
-                    continue
-                if ts > max_ts:
-                    # New timestamp watermark - reset the seen map
-                    max_ts = ts
-                    seen_map = {}
-                # Decide to emit:
-                # - Newer timestamp than offset: always emit
-                # - Equal to offset timestamp: emit if station unseen OR fingerprint changed
-                # - Equal to max timestamp: emit if not yet seen OR fingerprint different
-                should_emit = False
-                if ts > offset_iso:
-                    # Strictly newer - always emit
-                    should_emit = True
-                elif ts == offset_iso:
-                    # Same as offset - emit if value changed
-                    if seen_for_offset.get(sid) != fp:
+                more = len(rows) >= LIMIT
+                if more:
+                    page += 1
+                    pending = pool.submit(_fetch_page, base, page, offset_iso, select, ts_field)
+                for r in rows:
+                    ev = map_rec(r, ts_field)
+                    ev_get = ev.get
+                    ts = ev_get("ts")
+                    sid = ev_get("fiwareid")
+                    fp = ev_get("_fp")
+                    if not (ts and sid and fp):
+                        continue
+                    if ts > max_ts:
+                        # New timestamp watermark - reset the seen map
+                        max_ts = ts
+                        seen_map = {}
+                    # Decide to emit:
+                    # - Newer timestamp than offset: always emit
+                    # - Equal to offset timestamp: emit if station unseen OR fingerprint changed
+                    # - Equal to max timestamp: emit if not yet seen OR fingerprint different
+                    should_emit = False
+                    if ts > offset_iso:
+                        # Strictly newer - always emit
                         should_emit = True
-                elif ts == max_ts:
-                    # Same as current max - emit if not yet tracked
-                    if seen_map.get(sid) != fp:
-                        should_emit = True
-                if should_emit:
-                    out.append(ev)
-                    if ts == max_ts:
-                        # Track this station's fingerprint for current timestamp
-                        seen_map[sid] = fp
-            if len(rows) < LIMIT:
-                break
-            page += 1
-        if out:
-            break  # Got data from this base, don't try others
+                    elif ts == offset_iso:
+                        # Same as offset - emit if value changed
+                        if seen_for_offset_get(sid) != fp:
+                            should_emit = True
+                    elif ts == max_ts:
+                        # Same as current max - emit if not yet tracked
+                        if seen_map.get(sid) != fp:
+                            should_emit = True
+                    if should_emit:
+                        out.append(ev)
+                        if ts == max_ts:
+                            # Track this station's fingerprint for current timestamp
+                            seen_map[sid] = fp
+                if not more:
+                    break
+            if out:
+                break  # Got data from this base, don't try others
     # Determine new offset and seen map to persist
     # Only advance offset if we found strictly newer timestamps
     new_offset = max_ts if max_ts > offset_iso else offset_iso
@@ -436,6 +518,9 @@ def main():
         {
             "bootstrap.servers": BOOTSTRAP,
             "linger.ms": 50,
+            # Larger compressed batches; produce_all only enqueues and flushes once per poll
+            "batch.size": 131072,
+            "compression.type": "lz4",
             "enable.idempotence": True,
         }
     )
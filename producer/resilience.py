@@ -8,16 +8,23 @@ Implements the backoff & shed contract:
 """
 
 import json
+import math
 import os
 import random
+import struct
 import threading
 import time
-from dataclasses import dataclass, field
+import zlib
+from collections import deque
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
 from pathlib import Path
-from typing import Dict, List, Optional, Tuple
+from typing import Deque, Dict, Iterable, List, Optional, Tuple
 
 import requests
 from confluent_kafka import KafkaError, Producer
+from requests.adapters import HTTPAdapter
 
 
 # ------------- Configuration -------------
@@ -69,19 +76,17 @@ class ExponentialBackoff:
 
 
 # ------------- HTTP Retry Logic -------------
-RETRYABLE_STATUS_CODES = {429, 500, 502, 503, 504}
+RETRYABLE_STATUS_CODES = frozenset({429, 500, 502, 503, 504})
+_RETRYABLE_EXCEPTIONS = (
+    requests.exceptions.Timeout,
+    requests.exceptions.ConnectionError,
+    requests.exceptions.ChunkedEncodingError,
+)
 
 
 def is_retryable_error(exc: Exception) -> bool:
     """Checks if exception is retryable (timeout or connection error)."""
-    return isinstance(
-        exc,
-        (
-            requests.exceptions.Timeout,
-            requests.exceptions.ConnectionError,
-            requests.exceptions.ChunkedEncodingError,
-        ),
-    )
+    return isinstance(exc, _RETRYABLE_EXCEPTIONS)
 
 
 def is_retryable_status(status_code: int) -> bool:
@@ -89,6 +94,22 @@ def is_retryable_status(status_code: int) -> bool:
     return status_code in RETRYABLE_STATUS_CODES
 
 
+def _retry_after_secs(value: Optional[str]) -> Optional[float]:
+    """Parses a Retry-After header (delay-seconds or HTTP-date) into seconds to wait, or None."""
+    if not value:
+        return None
+    # delay-seconds is by far the common form; isascii() keeps out Unicode digits int() rejects
+    if value.isascii() and value.isdigit():
+        return int(value)
+    try:
+        when = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if when.tzinfo is None:
+        when = when.replace(tzinfo=timezone.utc)
+    return max(0.0, (when - datetime.now(timezone.utc)).total_seconds())
+
+
 def http_request_with_retry(
     session: requests.Session, method: str, url: str, config: Optional[RetryConfig] = None, **kwargs
 ) -> requests.Response:
@@ -124,14 +145,11 @@ def http_request_with_retry(
             if is_retryable_status(resp.status_code):
                 if attempt < config.max_retries:
                     # Respecting Retry-After header if present
-                    retry_after = resp.headers.get("Retry-After")
-                    if retry_after:
-                        try:
-                            wait_secs = int(retry_after)
-                            time.sleep(wait_secs)
-                            continue
-                        except ValueError:
-                            pass
+                    wait_secs = _retry_after_secs(resp.headers.get("Retry-After"))
+                    if wait_secs is not None:
+                        # A far-off Retry-After must not stall the producer longer than any backoff would
+                        time.sleep(min(wait_secs, config.max_delay_ms / 1000.0))
+                        continue
                     backoff.sleep(attempt)
                     continue
                 # Max retries exhausted
@@ -149,6 +167,35 @@ def http_request_with_retry(
     raise RuntimeError("Unexpected state in http_request_with_retry")
 
 
+class TimeoutHTTPAdapter(HTTPAdapter):
+    """HTTPAdapter that applies a default (connect, read) timeout to requests that set none."""
+
+    def __init__(self, timeout: Tuple[float, float], **kwargs):
+        self.timeout = timeout
+        super().__init__(**kwargs)
+
+    def send(self, request, **kwargs):
+        if kwargs.get("timeout") is None:
+            kwargs["timeout"] = self.timeout
+        return super().send(request, **kwargs)
+
+
+def make_http_session(
+    user_agent: str, pool_maxsize: int = 4, timeout: Tuple[float, float] = (10, 60)
+) -> requests.Session:
+    """Creates a keep-alive session with a pooled adapter mounted for http and https.
+
+    The adapter never retries on its own; retries stay in http_request_with_retry.
+    Requests without an explicit timeout get the (connect, read) default.
+    """
+    session = requests.Session()
+    adapter = TimeoutHTTPAdapter(timeout, pool_connections=pool_maxsize, pool_maxsize=pool_maxsize, max_retries=0)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    session.headers.update({"User-Agent": user_agent})
+    return session
+
+
 # ------------- Inflight Limiter -------------
 class InflightLimiter:
     """Limits concurrent operations using a semaphore."""
@@ -174,10 +221,50 @@ class InflightLimiter:
 
 
 # ------------- On-Disk Queue (DLQ) -------------
+# Frame header: CRC32 of key+value, key length, value length (little-endian u32 each)
+_FRAME_HEADER = struct.Struct("<III")
+
+
+def _frame(key: bytes, value: bytes) -> bytes:
+    return _FRAME_HEADER.pack(zlib.crc32(value, zlib.crc32(key)), len(key), len(value)) + key + value
+
+
+def _scan_frames(data: bytes) -> Tuple[List[Tuple[bytes, bytes]], int, int]:
+    """Parses length-prefixed frames, skipping CRC mismatches and stopping at a torn tail.
+
+    Returns:
+        Tuple of (messages, end offset of the last intact frame, number of frames skipped on CRC mismatch)
+    """
+    view = memoryview(data)
+    end = len(data)
+    pos = 0
+    good_end = 0
+    skipped = 0
+    messages = []
+    header_size = _FRAME_HEADER.size
+    while pos + header_size <= end:
+        crc, klen, vlen = _FRAME_HEADER.unpack_from(view, pos)
+        key_start = pos + header_size
+        value_start = key_start + klen
+        pos = value_start + vlen
+        if pos > end:
+            break  # partially written final frame
+        key = bytes(view[key_start:value_start])
+        value = bytes(view[value_start:pos])
+        if zlib.crc32(value, zlib.crc32(key)) != crc:
+            skipped += 1
+            continue
+        messages.append((key, value))
+        good_end = pos
+    return messages, good_end, skipped
+
+
 class DiskQueue:
     """Persists failed messages to disk for retry.
 
-    Uses JSON-lines format for simplicity and append-only writes.
+    Messages are appended as length-prefixed binary frames through a handle kept open between
+    enqueues, so keys and values round-trip byte-for-byte. A torn tail left by a crash is trimmed
+    before the next append. A JSON-lines queue left by older versions is still drained by dequeue_all.
     """
 
     def __init__(self, queue_dir: Optional[str] = None, topic: str = "default"):
@@ -185,20 +272,72 @@ class DiskQueue:
             queue_dir = os.getenv("VLC_DLQ_DIR", "/state/dlq")
         self._dir = Path(queue_dir)
         self._topic = topic
-        self._queue_file = self._dir / f"{topic}.jsonl"
+        self._queue_file = self._dir / f"{topic}.dlq"
+        self._legacy_file = self._dir / f"{topic}.jsonl"
         self._lock = threading.Lock()
+        self._fh = None
         self._dir.mkdir(parents=True, exist_ok=True)
+        # Counting what a previous run left behind once; enqueue/dequeue_all keep it current
+        self._count = self._recover_on_disk()
+
+    def _recover_on_disk(self) -> int:
+        """Trims a torn or corrupt tail so appends start on a frame boundary and counts readable messages."""
+        count = 0
+        if self._queue_file.exists():
+            data = self._queue_file.read_bytes()
+            messages, good_end, skipped = _scan_frames(data)
+            if skipped:
+                print(f"[resilience] {self._queue_file}: skipped {skipped} corrupt frames")
+            if good_end < len(data):
+                # Appending after a partial frame would let its header swallow every later frame
+                with open(self._queue_file, "r+b") as f:
+                    f.truncate(good_end)
+                print(f"[resilience] {self._queue_file}: truncated {len(data) - good_end} trailing bytes")
+            count += len(messages)
+        if self._legacy_file.exists():
+            with open(self._legacy_file, "rb") as f:
+                count += sum(1 for line in f if line.strip())
+        return count
 
     def enqueue(self, key: bytes, value: bytes) -> None:
         """Appends a failed message to the disk queue."""
-        record = {
-            "key": key.decode("utf-8", errors="replace"),
-            "value": value.decode("utf-8", errors="replace"),
-            "ts": time.time(),
-        }
+        self.enqueue_many(((key, value),))
+
+    def enqueue_many(self, messages: Iterable[Tuple[bytes, bytes]]) -> int:
+        """Appends a batch of failed messages, handing them to the OS in as few writes as the buffer allows.
+
+        Returns:
+            Number of messages queued
+        """
+        frames = [_frame(key, value) for key, value in messages]
+        if not frames:
+            return 0
         with self._lock:
-            with open(self._queue_file, "a", encoding="utf-8") as f:
-                f.write(json.dumps(record) + "\n")
+            if self._fh is None:
+                self._count = self._recover_on_disk()
+                self._fh = open(self._queue_file, "ab")
+            for frame in frames:
+                self._fh.write(frame)
+            # Flushing before returning: nothing lingers in userspace where a crash would lose it
+            self._fh.flush()
+            self._count += len(frames)
+        return len(frames)
+
+    def _read_legacy(self) -> List[Tuple[bytes, bytes]]:
+        messages = []
+        with open(self._legacy_file, "r", encoding="utf-8") as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    rec = json.loads(line)
+                    key = rec.get("key", "").encode("utf-8")
+                    value = rec.get("value", "").encode("utf-8")
+                    messages.append((key, value))
+                except json.JSONDecodeError:
+                    continue
+        return messages
 
     def dequeue_all(self) -> List[Tuple[bytes, bytes]]:
         """Reads and clears all messages from the disk queue.
@@ -207,80 +346,105 @@ class DiskQueue:
             List of (key, value) tuples
         """
         with self._lock:
-            if not self._queue_file.exists():
-                return []
+            self._close_fh()
             messages = []
             try:
-                with open(self._queue_file, "r", encoding="utf-8") as f:
-                    for line in f:
-                        line = line.strip()
-                        if not line:
-                            continue
-                        try:
-                            rec = json.loads(line)
-                            key = rec.get("key", "").encode("utf-8")
-                            value = rec.get("value", "").encode("utf-8")
-                            messages.append((key, value))
-                        except json.JSONDecodeError:
-                            continue
-                # Clearing the queue after successful read
-                self._queue_file.unlink()
+                # Legacy entries are older than anything in the binary queue
+                if self._legacy_file.exists():
+                    messages.extend(self._read_legacy())
+                    self._legacy_file.unlink()
+                if self._queue_file.exists():
+                    frames, _, skipped = _scan_frames(self._queue_file.read_bytes())
+                    if skipped:
+                        print(f"[resilience] {self._queue_file}: skipped {skipped} corrupt frames")
+                    messages.extend(frames)
+                    # Clearing the queue after successful read
+                    self._queue_file.unlink()
             except FileNotFoundError:
                 pass
+            self._count = 0
             return messages
 
-    def size(self) -> int:
-        """Returns approximate number of messages in queue."""
+    def _close_fh(self) -> None:
+        if self._fh is not None:
+            self._fh.close()
+            self._fh = None
+
+    def close(self) -> None:
+        """Closes the append handle; the next enqueue reopens it."""
         with self._lock:
-            if not self._queue_file.exists():
-                return 0
-            try:
-                with open(self._queue_file, "r", encoding="utf-8") as f:
-                    return sum(1 for line in f if line.strip())
-            except FileNotFoundError:
-                return 0
+            self._close_fh()
+
+    def size(self) -> int:
+        """Returns number of messages in queue."""
+        return self._count
 
 
 # ------------- Rate Throttler -------------
-@dataclass
 class ProduceStats:
-    """Tracks produce success/failure statistics for rate throttling."""
+    """Tracks produce success/failure statistics for rate throttling.
+
+    Counts live in per-second buckets on the monotonic clock, so the window slides instead of
+    resetting all at once and is immune to wall-clock jumps. Running totals keep reads O(1).
+    """
 
-    success_count: int = 0
-    failure_count: int = 0
-    window_start: float = field(default_factory=time.time)
-    window_seconds: float = 60.0  # 1 minute window
+    def __init__(self, window_seconds: float = 60.0):
+        self.window_seconds = window_seconds
+        self._window_s = max(1, math.ceil(window_seconds))
+        # [second, successes, failures], oldest first
+        self._buckets: Deque[List[int]] = deque()
+        self._success = 0
+        self._failure = 0
+
+    def _advance(self) -> List[int]:
+        """Evicts buckets that left the window and returns the bucket for the current second."""
+        now_s = time.monotonic_ns() // 1_000_000_000
+        buckets = self._buckets
+        horizon = now_s - self._window_s
+        while buckets and buckets[0][0] <= horizon:
+            _, success, failure = buckets.popleft()
+            self._success -= success
+            self._failure -= failure
+        if not buckets or buckets[-1][0] != now_s:
+            buckets.append([now_s, 0, 0])
+        return buckets[-1]
 
     def record_success(self) -> None:
         """Records a successful produce."""
-        self._maybe_reset_window()
-        self.success_count += 1
+        self._advance()[1] += 1
+        self._success += 1
 
     def record_failure(self) -> None:
         """Records a failed produce."""
-        self._maybe_reset_window()
-        self.failure_count += 1
+        self._advance()[2] += 1
+        self._failure += 1
+
+    @property
+    def success_count(self) -> int:
+        """Returns successes in current window."""
+        self._advance()
+        return self._success
 
-    def _maybe_reset_window(self) -> None:
-        """Resets counters if window has elapsed."""
-        now = time.time()
-        if now - self.window_start > self.window_seconds:
-            self.success_count = 0
-            self.failure_count = 0
-            self.window_start = now
+    @property
+    def failure_count(self) -> int:
+        """Returns failures in current window."""
+        self._advance()
+        return self._failure
 
     @property
     def failure_ratio(self) -> float:
         """Returns failure ratio in current window."""
-        total = self.success_count + self.failure_count
+        self._advance()
+        total = self._success + self._failure
         if total == 0:
             return 0.0
-        return self.failure_count / total
+        return self._failure / total
 
     @property
     def total(self) -> int:
         """Returns total messages in current window."""
-        return self.success_count + self.failure_count
+        self._advance()
+        return self._success + self._failure
 
 
 class RateThrottler:
@@ -336,8 +500,10 @@ class ResilientProducer:
         topic: str,
         dlq_dir: Optional[str] = None,
         throttle_on_failures: bool = True,
+        queue_full_timeout: float = 10.0,
     ):
         self._producer = producer
+        self._queue_full_timeout = queue_full_timeout
         self._topic = topic
         self._dlq = DiskQueue(dlq_dir, topic)
         self._throttler = RateThrottler() if throttle_on_failures else None
@@ -361,6 +527,39 @@ class ResilientProducer:
             if self._throttler:
                 self._throttler.record_success()
 
+    def _send(self, key: bytes, value: bytes) -> bool:
+        """Hands one message to the client, serving delivery reports while the local queue is full.
+
+        Returns:
+            False if the queue stayed full for queue_full_timeout seconds (message not sent)
+        """
+        deadline = None
+        while True:
+            try:
+                self._producer.produce(
+                    self._topic,
+                    key=key,
+                    value=value,
+                    callback=self._delivery_callback,
+                )
+                return True
+            except BufferError:
+                now = time.monotonic()
+                if deadline is None:
+                    deadline = now + self._queue_full_timeout
+                elif now >= deadline:
+                    return False
+                # Local queue is full: serving delivery reports frees space, then retrying
+                self._producer.poll(0.1)
+
+    def _spill(self, batch: List[Tuple[str, bytes, bytes]]) -> None:
+        """Moves messages the client would not accept to the DLQ."""
+        with self._lock:
+            for msg_id, _, _ in batch:
+                self._pending.pop(msg_id, None)
+        self._dlq.enqueue_many((key, value) for _, key, value in batch)
+        print(f"[resilience] local queue full for {self._queue_full_timeout}s, {len(batch)} msgs queued to DLQ")
+
     def produce(self, key: bytes, value: bytes) -> None:
         """Produces a message with delivery tracking."""
         msg_id = f"{key.decode('utf-8', errors='replace')}:{hash(value)}"
@@ -369,12 +568,38 @@ class ResilientProducer:
         # Applying throttle if needed
         if self._throttler:
             self._throttler.maybe_throttle()
-        self._producer.produce(
-            self._topic,
-            key=key,
-            value=value,
-            callback=self._delivery_callback,
-        )
+        if not self._send(key, value):
+            self._spill([(msg_id, key, value)])
+
+    def produce_many(self, messages: Iterable[Tuple[bytes, bytes]]) -> int:
+        """Produces a batch with delivery tracking, registering it and applying the throttle once.
+
+        If the local queue stays full, the unsent rest of the batch goes straight back to the DLQ.
+
+        Returns:
+            Number of messages handed to the client
+        """
+        batch = [(f"{key.decode('utf-8', errors='replace')}:{hash(value)}", key, value) for key, value in messages]
+        if not batch:
+            return 0
+        with self._lock:
+            for msg_id, key, value in batch:
+                self._pending[msg_id] = (key, value)
+        if self._throttler:
+            self._throttler.maybe_throttle()
+        for sent, (_, key, value) in enumerate(batch):
+            if not self._send(key, value):
+                self._spill(batch[sent:])
+                return sent
+        return len(batch)
+
+    def poll(self, timeout: float = 0) -> int:
+        """Serves queued delivery reports without waiting for the whole queue to drain.
+
+        Returns:
+            Number of delivery callbacks served
+        """
+        return self._producer.poll(timeout)
 
     def flush(self, timeout: float = 30.0) -> int:
         """Flushes pending messages with timeout.
@@ -386,8 +611,7 @@ class ResilientProducer:
         if remaining > 0:
             # Some messages didn't get delivered - queue pending to DLQ
             with self._lock:
-                for key, value in self._pending.values():
-                    self._dlq.enqueue(key, value)
+                self._dlq.enqueue_many(self._pending.values())
                 self._pending.clear()
             print(f"[resilience] flush timeout, {remaining} msgs queued to DLQ")
         return remaining
@@ -399,12 +623,16 @@ class ResilientProducer:
             Number of messages retried
         """
         messages = self._dlq.dequeue_all()
-        for key, value in messages:
-            self.produce(key, value)
+        self.produce_many(messages)
         if messages:
             print(f"[resilience] retrying {len(messages)} msgs from DLQ")
         return len(messages)
 
+    @property
+    def outstanding(self) -> int:
+        """Returns number of messages still waiting for a delivery report."""
+        return len(self._producer)
+
     @property
     def dlq_size(self) -> int:
         """Returns number of messages in DLQ."""
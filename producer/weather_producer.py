@@ -1,14 +1,17 @@
 import hashlib
 import json
+import math
 import os
 import re
 import signal
+import struct
 import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timezone
+from functools import lru_cache
 from pathlib import Path
 from typing import Any, Dict, Iterable, List, Optional, Tuple
 
-import requests
 from confluent_kafka import Producer
 from confluent_kafka.schema_registry import SchemaRegistryClient
 from confluent_kafka.schema_registry.json_schema import JSONSerializer
@@ -18,8 +21,38 @@ from resilience import (
     ResilientProducer,
     RetryConfig,
     http_request_with_retry,
+    make_http_session,
 )
 
+# orjson when available (bytes in/out, native code); stdlib json otherwise
+try:
+    import orjson
+
+    _json_dumps = orjson.dumps
+    _json_loads = orjson.loads
+except ImportError:
+
+    def _json_dumps(obj: Any) -> bytes:
+        return json.dumps(obj).encode("utf-8")
+
+    _json_loads = json.loads
+
+
+# Non-cryptographic digest for change detection: xxh3-128 (32 hex chars), SHA1 (40) as fallback.
+# FP_VERSION names digest and payload encoding; saved fingerprints from any other version are dropped.
+try:
+    import xxhash
+
+    _hexdigest = xxhash.xxh3_128_hexdigest
+    FP_VERSION = "xxh3_128-f64"
+except ImportError:
+
+    def _hexdigest(data: bytes) -> str:
+        return hashlib.sha1(data).hexdigest()
+
+    FP_VERSION = "sha1-f64"
+
+
 # --------- env ---------
 BASE1 = os.getenv("VLC_EXPLORE_BASE", "https://valencia.opendatasoft.com/api/explore/v2.1")
 BASE2 = os.getenv("VLC_EXPLORE_BASE2", "https://valencia.opendatasoft.com/api/v2")
@@ -32,6 +65,16 @@ SCHEMA_REGISTRY_URL = os.getenv("SCHEMA_REGISTRY_URL", "http://schema-registry:8
 POLL_SECS = int(os.getenv("POLL_EVERY_SECONDS", "300"))
 LIMIT = int(os.getenv("PAGE_LIMIT", "100"))
 
+# Producer batching: produce_all only enqueues, serving delivery reports every PRODUCE_POLL_EVERY messages
+LINGER_MS = 50
+BATCH_SIZE = 131072
+COMPRESSION_TYPE = "lz4"
+PRODUCE_POLL_EVERY = 500
+# End-of-batch drain: poll in short slices so a stop signal is noticed, giving up after FLUSH_TIMEOUT_SECS
+# Floored at 10ms: 0 would busy-spin poll(0) and a negative value would make poll() block indefinitely
+FLUSH_POLL_INTERVAL_MS = max(10, int(os.getenv("FLUSH_POLL_INTERVAL_MS", "500")))
+FLUSH_TIMEOUT_SECS = 30.0
+
 # Loading JSON schema for Schema Registry
 SCHEMA_PATH = Path(__file__).parent / "schemas" / "weather.json"
 with open(SCHEMA_PATH, "r", encoding="utf-8") as f:
@@ -69,11 +112,29 @@ DESIRED_FIELDS = [
 ]
 
 # Which fields define a change if ts is the same?
-CHANGE_FIELDS = ["viento_dir", "viento_vel", "temperatur", "humedad_re", "presion_ba", "precipitac"]
+CHANGE_FIELDS = ("viento_dir", "viento_vel", "temperatur", "humedad_re", "presion_ba", "precipitac")
+# CHANGE_FIELDS packed as little-endian doubles in field order; a missing value packs as NaN, never 0.0
+_FP_PACK = struct.Struct("<" + "d" * len(CHANGE_FIELDS)).pack
+
+# Date-like field names tried in order when TIMESTAMP_FIELD is not in the dataset
+TS_CANDIDATES = (
+    "fecha_carg",
+    "update_jcd",
+    "timestamp",
+    "fechahora",
+    "fecha",
+    "updated_at",
+    "date",
+    "data",
+    "last_update",
+)
 
-session = requests.Session()
-session.headers.update({"User-Agent": "vlc-python-producer/1.4"})
-session.timeout = (10, 60)  # connect, read
+# Pooled keep-alive connections, reused across pages and both API bases
+session = make_http_session(
+    "vlc-python-producer/1.4",
+    pool_maxsize=int(os.getenv("VLC_HTTP_POOL_SIZE", "4")),
+    timeout=(10, 60),  # connect, read
+)
 
 # Resilience configuration
 RETRY_CONFIG = RetryConfig.from_env()
@@ -122,8 +183,15 @@ def load_state() -> Tuple[str, dict]:
     os.makedirs(STATE_DIR, exist_ok=True)
     if os.path.exists(STATE_JSON):
         try:
-            d = json.load(open(STATE_JSON, "r", encoding="utf-8"))
-            return d.get("offset", START_OFFSET), dict(d.get("seen_for_offset", {}))
+            with open(STATE_JSON, "rb") as f:
+                d = _json_loads(f.read())
+            seen = d.get("seen_for_offset", {})
+            if d.get("fp_version") != FP_VERSION:
+                # Fingerprints in another format never match: start the offset window afresh
+                if seen:
+                    print(f"[weather] fingerprint format changed to {FP_VERSION}, discarding seen_for_offset")
+                seen = {}
+            return d.get("offset", START_OFFSET), dict(seen)
         except Exception:
             pass
     # fallback to your old offset.txt if present
@@ -131,20 +199,30 @@ def load_state() -> Tuple[str, dict]:
     return off, {}  # fallback if migrating
 
 
+def _atomic_write(path: str, data: bytes) -> None:
+    """Writes data to a sibling temp file and swaps it in, so a crash never leaves a truncated file."""
+    tmp = f"{path}.tmp"
+    with open(tmp, "wb") as f:
+        f.write(data)
+    os.replace(tmp, path)
+
+
 def save_state(offset_iso: str, seen_map: dict) -> None:
     """Saves the current offset and station → fingerprint map to JSON."""
     os.makedirs(STATE_DIR, exist_ok=True)
-    with open(STATE_JSON, "w", encoding="utf-8") as f:
-        json.dump({"offset": offset_iso, "seen_for_offset": seen_map}, f)
+    state = {"offset": offset_iso, "fp_version": FP_VERSION, "seen_for_offset": seen_map}
+    _atomic_write(STATE_JSON, _json_dumps(state))
 
 
 def save_offset(iso: str) -> None:
     os.makedirs(STATE_DIR, exist_ok=True)
-    with open(OFFSET_FILE, "w", encoding="utf-8") as f:
-        f.write(iso)
+    _atomic_write(OFFSET_FILE, iso.encode("utf-8"))
 
 
-POINT_RX = re.compile(r"POINT\s*\(\s*([-\d\.]+)\s+([-\d\.]+)\s*\)")
+# WKT "POINT (lon lat)"; each group only matches a well-formed decimal, so float() cannot fail on it
+POINT_RX = re.compile(r"POINT\s*\(\s*(-?\d+(?:\.\d+)?)\s+(-?\d+(?:\.\d+)?)\s*\)")
+# UTC timestamps (Z or +00:00, optional subseconds) as served by ODS; group 1 is the part we keep
+UTC_TS_RX = re.compile(r"([0-9]{4}-[0-9]{2}-[0-9]{2}T[0-9]{2}:[0-9]{2}:[0-9]{2})(?:\.[0-9]+)?(?:Z|[+-]00:00)")
 
 
 def extract_lat_lon(geo: Any) -> Tuple[Optional[float], Optional[float]]:
@@ -152,24 +230,34 @@ def extract_lat_lon(geo: Any) -> Tuple[Optional[float], Optional[float]]:
     Extracts lat/lon from geo_point_2d, rounding to 6 decimals (~11cm) to
     normalize inconsistent API precision for the same station.
     """
-    lat, lon = None, None
-    if isinstance(geo, dict):
+    # Parsed JSON only yields exact dict/str, so an identity check replaces the isinstance MRO walk
+    t = type(geo)
+    if t is dict:
         # ODS v2.1 often returns {"lat":..., "lon":...}
         try:
-            lat, lon = float(geo.get("lat")), float(geo.get("lon"))
-        except Exception:
+            lat, lon = float(geo["lat"]), float(geo["lon"])
+        except (KeyError, TypeError, ValueError):
             return (None, None)
-    elif isinstance(geo, str):
+    elif t is str:
         m = POINT_RX.match(geo)
-        if m:
-            lon, lat = float(m.group(1)), float(m.group(2))
-    if lat is not None and lon is not None:
-        return round(lat, 6), round(lon, 6)
-    return (None, None)
+        if not m:
+            return (None, None)
+        lon, lat = float(m.group(1)), float(m.group(2))
+    else:
+        return (None, None)
+    return round(lat, 6), round(lon, 6)
 
 
+# Rows in one poll share a handful of sample times, so most calls are cache hits
+@lru_cache(maxsize=1024)
 def normalize_ts(s: str) -> str:
     # Ensure "YYYY-MM-DDTHH:MM:SSZ" (no millis)
+    m = UTC_TS_RX.fullmatch(s)
+    if m:
+        # Already UTC: truncating subseconds is all that's needed once the fields parse as a real date
+        head = m.group(1)
+        datetime.fromisoformat(head)
+        return head + "Z"
     try:
         dt = datetime.fromisoformat(s.replace("Z", "+00:00"))
     except Exception:
@@ -186,9 +274,14 @@ def normalize_ts(s: str) -> str:
 
 def value_fingerprint(rec: dict) -> str:
     """Creates a fingerprint of the value fields to detect data changes."""
-    payload = {k: rec.get(k) for k in CHANGE_FIELDS}
-    s = json.dumps(payload, sort_keys=True, separators=(",", ":"))
-    return hashlib.sha1(s.encode("utf-8")).hexdigest()
+    get = rec.get
+    try:
+        return _hexdigest(_FP_PACK(*[math.nan if (v := get(k)) is None else v for k in CHANGE_FIELDS]))
+    except (struct.error, OverflowError, TypeError):
+        # A non-numeric or out-of-range reading: fall back to the key-sorted JSON of the fields.
+        # Stdlib json on purpose: orjson rejects ints beyond 64 bits, which would abort the run here.
+        payload = json.dumps({k: get(k) for k in CHANGE_FIELDS}, sort_keys=True, separators=(",", ":"))
+        return _hexdigest(payload.encode("utf-8"))
 
 
 def map_record(r: Dict[str, Any], ts_field: str) -> Dict[str, Any]:
@@ -208,23 +301,27 @@ def map_record(r: Dict[str, Any], ts_field: str) -> Dict[str, Any]:
         "lat": lat,
         "lon": lon,
     }
-    # Add fingerprint based on mapped values
-    out["_fp"] = value_fingerprint(
-        {
-            "viento_dir": out["wind_dir_deg"],
-            "viento_vel": out["wind_speed_ms"],
-            "temperatur": out["temperature_c"],
-            "humedad_re": out["humidity_pct"],
-            "presion_ba": out["pressure_hpa"],
-            "precipitac": out["precip_mm"],
-        }
-    )
+    # Mapped values are the raw CHANGE_FIELDS unchanged, so fingerprint the row without a renamed copy
+    out["_fp"] = value_fingerprint(r)
     return out
 
 
+def producer_config() -> Dict[str, Any]:
+    """Returns the confluent_kafka.Producer config: idempotent, lz4-compressed, lingering into large batches."""
+    return {
+        "bootstrap.servers": BOOTSTRAP,
+        "linger.ms": LINGER_MS,
+        "batch.size": BATCH_SIZE,
+        "compression.type": COMPRESSION_TYPE,
+        "enable.idempotence": True,
+    }
+
+
 def produce_all(p: ResilientProducer, events: Iterable[Dict[str, Any]], serializer: JSONSerializer) -> None:
     """Produces events to Kafka with resilience (DLQ on failure)."""
     ctx = SerializationContext(TOPIC, MessageField.VALUE)
+    poll_every = PRODUCE_POLL_EVERY
+    produced = 0
     for ev in events:
         if not ev.get("ts"):  # skip malformed rows without timestamp
             continue
@@ -233,7 +330,16 @@ def produce_all(p: ResilientProducer, events: Iterable[Dict[str, Any]], serializ
         key = f"{ev['fiwareid']}|{ev['ts']}"
         value_bytes = serializer(kafka_ev, ctx)
         p.produce(key=key.encode("utf-8"), value=value_bytes)
-    p.flush()
+        produced += 1
+        if produced % poll_every == 0:
+            # Delivery reports feed the DLQ and throttler; serve them mid-batch, not only at flush
+            p.poll(0)
+    deadline = time.monotonic() + FLUSH_TIMEOUT_SECS
+    interval = FLUSH_POLL_INTERVAL_MS / 1000
+    while running and p.outstanding and time.monotonic() < deadline:
+        p.poll(interval)
+    # Anything still queued after a stop or timeout is moved to the DLQ
+    p.flush(0)
 
 
 # ------------- metadata helpers -------------
@@ -270,26 +376,16 @@ def fetch_one_record(base: str) -> Optional[Dict[str, Any]]:
 
 
 def choose_ts_field(avail_fields: List[str], sample: Optional[Dict[str, Any]]) -> Optional[str]:
+    avail = set(avail_fields)
     # 1) honor env if present in dataset
-    if TIMESTAMP_FIELD in avail_fields:
+    if TIMESTAMP_FIELD in avail:
         return TIMESTAMP_FIELD
     if not AUTO_TS_FIELD:
         return TIMESTAMP_FIELD  # let it fail fast later if missing
 
     # 2) try meta-typed date-like names
-    candidates = [
-        "fecha_carg",
-        "update_jcd",
-        "timestamp",
-        "fechahora",
-        "fecha",
-        "updated_at",
-        "date",
-        "data",
-        "last_update",
-    ]
-    for c in candidates:
-        if c in avail_fields:
+    for c in TS_CANDIDATES:
+        if c in avail:
             return c
 
     # 3) infer from sample: pick first key containing plausible date text
@@ -301,13 +397,31 @@ def choose_ts_field(avail_fields: List[str], sample: Optional[Dict[str, Any]]) -
 
 
 def compute_select(avail_fields: List[str], ts_field: str) -> str:
-    fields = [f for f in DESIRED_FIELDS if f in avail_fields]
+    avail = set(avail_fields)
+    fields = [f for f in DESIRED_FIELDS if f in avail]
     if ts_field not in fields:
         fields = fields + [ts_field]
     return ",".join(fields)
 
 
 # ------------- fetching loop -------------
+def _fetch_page(base: str, page: int, offset_iso: str, select: str, ts_field: str) -> List[Dict[str, Any]]:
+    """Fetches one page of records at or after offset_iso from a single API base."""
+    params = {
+        "order_by": ts_field,
+        "limit": str(LIMIT),
+        "offset": str(page * LIMIT),
+        "select": select,
+        "where": f"{ts_field}>=date'{offset_iso}'",
+    }
+    resp = http_request_with_retry(
+        session, "GET", f"{base}/catalog/datasets/{DATASET_ID}/records", config=RETRY_CONFIG, params=params
+    )
+    resp.raise_for_status()
+    # Parsing the raw body with orjson instead of requests' stdlib-json Response.json()
+    return _json_loads(resp.content).get("results", [])
+
+
 def fetch_since(
     offset_iso: str, seen_for_offset: dict, bases: List[str], select: str, ts_field: str
 ) -> Tuple[List[Dict[str, Any]], str, dict]:
@@ -321,67 +435,63 @@ def fetch_since(
     out: List[Dict[str, Any]] = []
     max_ts = offset_iso
     seen_map = dict(seen_for_offset)  # copy to track current window
-    for base in bases:
-        page = 0
-        while True:
-            params = {
-                "order_by": ts_field,
-                "limit": str(LIMIT),
-                "offset": str(page * LIMIT),
-                "select": select,
-                "where": f"{ts_field}>=date'{offset_iso}'",
-            }
-            try:
-                resp = http_request_with_retry(
-                    session, "GET", f"{base}/catalog/datasets/{DATASET_ID}/records", config=RETRY_CONFIG, params=params
-                )
-                resp.raise_for_status()
-                rows = resp.json().get("results", [])
-            except Exception:
-                # Try next base if nothing collected yet
-                if not out:
+    # Bases are failovers for the same dataset, so they stay sequential; within a base the next
+    # page is requested in the background while the current one is deduplicated
+    with ThreadPoolExecutor(max_workers=1) as pool:
+        for base in bases:
+            page = 0
+            pending = pool.submit(_fetch_page, base, page, offset_iso, select, ts_field)
+            while True:
+                try:
+                    rows = pending.result()
+                except Exception:
+                    # Try next base if nothing collected yet
+                    if not out:
+                        break
+                    else:
+                        return out, max_ts, seen_map
+                if not rows:
                     break
-                else:
-                    return out, max_ts, seen_map
-            if not rows:
-                break
-            for r in rows:
-                ev = map_record(r, ts_field)
-                ts = ev.get("ts")
-                sid = ev.get("fiwareid")
-                fp = ev.get("_fp")
-                if not (ts and sid and fp):
-                    continue
-                if ts > max_ts:
-                    # New timestamp watermark - reset the seen map
-                    max_ts = ts
-                    seen_map = {}
-                # Decide to emit:
-                # - Newer timestamp than offset: always emit
-                # - Equal to offset timestamp: emit if station unseen OR fingerprint changed
-                # - Equal to max timestamp: emit if not yet seen OR fingerprint different
-                should_emit = False
-                if ts > offset_iso:
-                    # Strictly newer - always emit
-                    should_emit = True
-                elif ts == offset_iso:
-                    # Same as offset - emit if value changed
-                    if seen_for_offset.get(sid) != fp:
+                more = len(rows) >= LIMIT
+                if more:
+                    page += 1
+                    pending = pool.submit(_fetch_page, base, page, offset_iso, select, ts_field)
+                for r in rows:
+                    ev = map_record(r, ts_field)
+                    ts = ev.get("ts")
+                    sid = ev.get("fiwareid")
+                    fp = ev.get("_fp")
+                    if not (ts and sid and fp):
+                        continue
+                    if ts > max_ts:
+                        # New timestamp watermark - reset the seen map
+                        max_ts = ts
+                        seen_map = {}
+                    # Decide to emit:
+                    # - Newer timestamp than offset: always emit
+                    # - Equal to offset timestamp: emit if station unseen OR fingerprint changed
+                    # - Equal to max timestamp: emit if not yet seen OR fingerprint different
+                    should_emit = False
+                    if ts > offset_iso:
+                        # Strictly newer - always emit
                         should_emit = True
-                elif ts == max_ts:
-                    # Same as current max - emit if not yet tracked
-                    if seen_map.get(sid) != fp:
-                        should_emit = True
-                if should_emit:
-                    out.append(ev)
-                    if ts == max_ts:
-                        # Track this station's fingerprint for current timestamp
-                        seen_map[sid] = fp
-            if len(rows) < LIMIT:
-                break
-            page += 1
-        if out:
-            break  # Got data from this base, don't try others
+                    elif ts == offset_iso:
+                        # Same as offset - emit if value changed
+                        if seen_for_offset.get(sid) != fp:
+                            should_emit = True
+                    elif ts == max_ts:
+                        # Same as current max - emit if not yet tracked
+                        if seen_map.get(sid) != fp:
+                            should_emit = True
+                    if should_emit:
+                        out.append(ev)
+                        if ts == max_ts:
+                            # Track this station's fingerprint for current timestamp
+                            seen_map[sid] = fp
+                if not more:
+                    break
+            if out:
+                break  # Got data from this base, don't try others
     # Determine new offset and seen map to persist
     # Only advance offset if we found strictly newer timestamps
     new_offset = max_ts if max_ts > offset_iso else offset_iso
@@ -431,13 +541,7 @@ def main():
     schema_registry_client = SchemaRegistryClient({"url": SCHEMA_REGISTRY_URL})
     json_serializer = JSONSerializer(WEATHER_SCHEMA_STR, schema_registry_client)
     print(f"[weather] using Schema Registry at {SCHEMA_REGISTRY_URL}")
-    raw_producer = Producer(
-        {
-            "bootstrap.servers": BOOTSTRAP,
-            "linger.ms": 50,
-            "enable.idempotence": True,
-        }
-    )
+    raw_producer = Producer(producer_config())
     producer = ResilientProducer(raw_producer, TOPIC, dlq_dir=DLQ_DIR)
     while running:
         try:
@@ -17,7 +17,6 @@ Usage:
 from __future__ import annotations
 
 import argparse
-import csv
 import json
 import math
 import os
@@ -52,7 +51,8 @@ def iso_to_utc(ts: str) -> datetime:
     Parse ODS timestamp strings like '2025-10-19T13:50:00+00:00' to aware UTC.
     Strips subseconds if present (same fixup pattern as the air checker).  :contentReference[oaicite:2]{index=2}
     """
-    ts = ts.replace("Z", "+00:00")
+    if "Z" in ts:  # ODS mostly returns "+00:00" already; skip the copy then
+        ts = ts.replace("Z", "+00:00")
     if "." in ts:
         left, right = ts.split(".", 1)
         # preserve timezone portion if present after '.'
@@ -148,11 +148,11 @@ def write_last_tick(tick: str) -> None:
 def append_csv_row(wall_utc: datetime, tick_utc: datetime, rows: int, stations: int) -> None:
     ensure_state_dir()
     existed = os.path.exists(CSV_FILE)
+    # ISO timestamps and ints never need CSV quoting, so write the line directly
     with open(CSV_FILE, "a", newline="", encoding="utf-8") as f:
-        w = csv.writer(f)
         if not existed:
-            w.writerow(["wall_time_utc", "tick_utc", "rows", "stations"])
-        w.writerow([wall_utc.isoformat(), tick_utc.isoformat(), rows, stations])
+            f.write("wall_time_utc,tick_utc,rows,stations\r\n")
+        f.write(f"{wall_utc.isoformat()},{tick_utc.isoformat()},{rows},{stations}\r\n")
 
 
 def summarize_deltas(deltas_h: list[float]) -> str:
@@ -49,7 +49,8 @@ def build_url(spec: str) -> str:
 
 def iso_to_utc(ts: str) -> datetime:
     # Normalize e.g. "2025-10-19T13:50:00+00:00" and "…Z" to aware UTC
-    ts = ts.replace("Z", "+00:00")
+    if "Z" in ts:  # ODS mostly returns "+00:00" already; skip the copy then
+        ts = ts.replace("Z", "+00:00")
     if "." in ts:
         left, right = ts.split(".", 1)
         if "+" in right or "-" in right:
@@ -121,14 +122,14 @@ def short_name(full: str) -> str:
 
 
 def collect_ticks(rows: List[dict]) -> Tuple[datetime, List[datetime]]:
-    ticks = []
-    for r in rows:
-        ts = r.get("fecha_carg")
-        if ts:
-            ticks.append(iso_to_utc(ts))
-    if not ticks:
+    # Snapshot rows almost always share one tick: parse each distinct string once, not once per row
+    raw = {r.get("fecha_carg") for r in rows}
+    raw.discard(None)
+    raw.discard("")
+    if not raw:
         raise SystemExit("Snapshot rows lacked 'fecha_carg'.")
-    return max(ticks), sorted(set(ticks))
+    ticks = sorted({iso_to_utc(ts) for ts in raw})
+    return ticks[-1], ticks
 
 
 def print_block(
@@ -216,21 +217,22 @@ def main():
                 last_max_tick = max_tick
             else:
                 # No new max tick; detect stations that newly caught up (partial advance)
-                updated_rows = []
+                # Keep (fid, tick) from the detection pass so the update loop doesn't re-parse
+                updated: List[Tuple[str, datetime, dict]] = []
                 for r in rows:
                     fid = station_key(r)
                     tick = iso_to_utc(r["fecha_carg"])
                     prev = last_seen.get(fid)
                     if prev is None or tick > prev:
-                        updated_rows.append(r)
-                if updated_rows:
+                        updated.append((fid, tick, r))
+                if updated:
                     title = (
                         f"[{wall}] PARTIAL ADVANCE → stations caught up to {max_tick.strftime('%Y-%m-%d %H:%M:%S')} UTC"
                     )
+                    updated_rows = [r for _, _, r in updated]
                     print_block(title, rows=updated_rows, last_seen=last_seen, show_only_updated=True)
-                    for r in updated_rows:
-                        fid = station_key(r)
-                        last_seen[fid] = iso_to_utc(r["fecha_carg"])
+                    for fid, tick, _ in updated:
+                        last_seen[fid] = tick
 
             time.sleep(max(1, args.interval))
     except KeyboardInterrupt:
@@ -1,47 +1,122 @@
 """Shared fixtures for Kafka infrastructure tests."""
 
+import json
+import re
+from collections import Counter
 from pathlib import Path
-from typing import Dict
+from typing import Any, Dict
 
 import pytest
+import yaml
 
+try:
+    import orjson
 
-@pytest.fixture
+    _json_loads = orjson.loads
+except ImportError:
+    _json_loads = json.loads
+
+_CLEANUP_POLICY_RE = re.compile(r"--config cleanup\.policy=(compact|delete)")
+
+# libyaml C loader when available; pure-Python SafeLoader otherwise
+_YAML_LOADER = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+
+_PROJECT_ROOT = Path(__file__).parent.parent
+_CONNECT_CONFIG_DIR = _PROJECT_ROOT / "connect" / "config"
+_AIR_CONNECTOR_CONFIG_PATH = _CONNECT_CONFIG_DIR / "jdbc-sink.timescale.air.json"
+_WEATHER_CONNECTOR_CONFIG_PATH = _CONNECT_CONFIG_DIR / "jdbc-sink.timescale.weather.json"
+
+# Connector configs are parsed at import time so the fixtures below do no I/O (read-only; do not mutate)
+_AIR_CONNECTOR_CONFIG: Dict[str, Any] = _json_loads(_AIR_CONNECTOR_CONFIG_PATH.read_bytes())
+_WEATHER_CONNECTOR_CONFIG: Dict[str, Any] = _json_loads(_WEATHER_CONNECTOR_CONFIG_PATH.read_bytes())
+
+
+@pytest.fixture(scope="session")
 def project_root() -> Path:
     """Returns the project root directory."""
-    return Path(__file__).parent.parent
+    return _PROJECT_ROOT
 
 
-@pytest.fixture
+@pytest.fixture(scope="session")
 def compose_file(project_root: Path) -> Path:
     """Returns path to docker-compose.yml."""
     return project_root / "compose" / "docker-compose.yml"
 
 
-@pytest.fixture
+@pytest.fixture(scope="session")
 def dockerfile_path(project_root: Path) -> Path:
     """Returns path to Kafka Connect Dockerfile."""
     return project_root / "connect" / "Dockerfile"
 
 
-@pytest.fixture
-def air_connector_config_path(project_root: Path) -> Path:
+@pytest.fixture(scope="session")
+def air_connector_config_path() -> Path:
     """Returns path to air quality JDBC sink connector configuration."""
-    return project_root / "connect" / "config" / "jdbc-sink.timescale.air.json"
+    return _AIR_CONNECTOR_CONFIG_PATH
 
 
-@pytest.fixture
-def weather_connector_config_path(project_root: Path) -> Path:
+@pytest.fixture(scope="session")
+def weather_connector_config_path() -> Path:
     """Returns path to weather JDBC sink connector configuration."""
-    return project_root / "connect" / "config" / "jdbc-sink.timescale.weather.json"
+    return _WEATHER_CONNECTOR_CONFIG_PATH
 
 
-@pytest.fixture
+@pytest.fixture(scope="session")
+def compose_config(compose_file: Path) -> Dict[str, Any]:
+    """Returns docker-compose.yml parsed once per session (read-only; tests must not mutate it)."""
+    return yaml.load(compose_file.read_text(encoding="utf-8"), Loader=_YAML_LOADER)
+
+
+@pytest.fixture(scope="session")
+def air_connector_config() -> Dict[str, Any]:
+    """Returns the pre-parsed air quality connector configuration (read-only)."""
+    return _AIR_CONNECTOR_CONFIG
+
+
+@pytest.fixture(scope="session")
+def weather_connector_config() -> Dict[str, Any]:
+    """Returns the pre-parsed weather connector configuration (read-only)."""
+    return _WEATHER_CONNECTOR_CONFIG
+
+
+@pytest.fixture(scope="session", params=["air", "weather"])
+def connector_kind(request: pytest.FixtureRequest) -> str:
+    """Parametrizes connector tests over the air and weather JDBC sinks."""
+    return request.param
+
+
+@pytest.fixture(scope="session")
+def connector_config(
+    connector_kind: str, air_connector_config: Dict[str, Any], weather_connector_config: Dict[str, Any]
+) -> Dict[str, Any]:
+    """Returns the parsed connector configuration matching connector_kind (read-only)."""
+    return {"air": air_connector_config, "weather": weather_connector_config}[connector_kind]
+
+
+@pytest.fixture(scope="session")
 def bootstrap_script_path(project_root: Path) -> Path:
     """Returns path to Kafka bootstrap script."""
     return project_root / "scripts" / "bootstrap_kafka.sh"
 
 
+@pytest.fixture(scope="session")
+def dockerfile_content(dockerfile_path: Path) -> str:
+    """Returns the Kafka Connect Dockerfile text, read once per session."""
+    return dockerfile_path.read_text()
+
+
+@pytest.fixture(scope="session")
+def bootstrap_script_content(bootstrap_script_path: Path) -> str:
+    """Returns the Kafka bootstrap script text, read once per session."""
+    return bootstrap_script_path.read_text()
+
+
+@pytest.fixture(scope="session")
+def bootstrap_cleanup_policy_counts(bootstrap_script_content: str) -> Counter:
+    """Returns how many times each cleanup.policy value is passed to create_topic in the bootstrap script."""
+    return Counter(_CLEANUP_POLICY_RE.findall(bootstrap_script_content))
+
+
 @pytest.fixture
 def kafka_data_topic_config() -> Dict[str, any]:
     """Returns expected configuration for data topics."""
@@ -0,0 +1,17 @@
+"""Shared setup for unit tests."""
+
+import sys
+from pathlib import Path
+
+import pytest
+
+# Make producer modules importable; guarded so sys.path holds the entry once per session
+_PRODUCER_DIR = str(Path(__file__).parents[2] / "producer")
+if _PRODUCER_DIR not in sys.path:
+    sys.path.insert(0, _PRODUCER_DIR)
+
+
+@pytest.fixture(scope="session")
+def empty_state_dir(tmp_path_factory: pytest.TempPathFactory) -> Path:
+    """Returns a directory created once per session that tests must never write into."""
+    return tmp_path_factory.mktemp("empty_state")
@@ -1,29 +1,82 @@
 import json
 import sys
-from pathlib import Path
-from typing import Any, Dict, List
+from typing import Any, Dict, List, NamedTuple, Tuple
 
+import air_producer as ap
 import pytest
 
-# Make producer modules importable
-sys.path.append(str(Path(__file__).parents[2] / "producer"))
-import air_producer as ap  # noqa: E402
+try:
+    import orjson
+
+    def _dumps_bytes(data: Dict[str, Any]) -> bytes:
+        return orjson.dumps(data)
+except ImportError:
+
+    def _dumps_bytes(data: Dict[str, Any]) -> bytes:
+        return json.dumps(data).encode("utf-8")
+
+
+# Shared read-only API payloads; producer code never mutates the rows it is given
+_ROW_OLIVERETA = {
+    "fiwareid": "A10_OLIVERETA_60m",
+    "fecha_carg": "2025-10-18T17:00:00+00:00",
+    "so2": None,
+    "no2": 24.0,
+    "o3": None,
+    "co": None,
+    "pm10": 16.0,
+    "pm25": 7.0,
+    "calidad_am": "Buena",
+    "geo_point_2d": {"lat": 39.46924423509195, "lon": -0.40592344552906795},
+}
+_ROW_A01 = {
+    "fiwareid": "A01",
+    "fecha_carg": "2025-10-18T18:00:00+00:00",
+    "no2": 10.0,
+    "pm10": 12.0,
+    "pm25": 4.0,
+    "geo_point_2d": {"lat": 39.1, "lon": -0.3},
+}
+_ROW_A02 = {
+    "fiwareid": "A02",
+    "fecha_carg": "2025-10-18T18:00:00+00:00",
+    "no2": 20.0,
+    "pm10": 18.0,
+    "pm25": 7.0,
+    "geo_point_2d": {"lat": 39.2, "lon": -0.31},
+}
+# Two stations reporting at the same timestamp
+_PAGE0 = {"total_count": 2, "results": [_ROW_A01, _ROW_A02]}
+_PAGE_A01 = {"results": [_ROW_A01]}
+_METADATA_FIELDS = {
+    "dataset": {
+        "fields": [
+            {"name": "objectid"},
+            {"name": "fiwareid"},
+            {"name": "so2"},
+            {"name": "no2"},
+            {"name": "fecha_carg"},
+            {"name": "geo_point_2d"},
+        ]
+    }
+}
+
+
+class ProducedCall(NamedTuple):
+    """One recorded produce() call."""
+
+    key: bytes
+    value: bytes
 
 
 class DummyProducer:
     """Mock for confluent_kafka.Producer (legacy tests)."""
 
     def __init__(self):
-        self.calls: List[Dict[str, Any]] = []
+        self.calls: List[Tuple[str, bytes, bytes]] = []
 
     def produce(self, topic: str, key: bytes, value: bytes):
-        self.calls.append(
-            {
-                "topic": topic,
-                "key": key,
-                "value": value,
-            }
-        )
+        self.calls.append((topic, key, value))
 
     def flush(self):
         return 0
@@ -33,53 +86,128 @@ class DummyResilientProducer:
     """Mock for ResilientProducer."""
 
     def __init__(self):
-        self.calls: List[Dict[str, Any]] = []
+        self.calls: List[ProducedCall] = []
+        self.outstanding = 0
+        self.polls = 0
+        self.flushes = 0
 
     def produce(self, key: bytes, value: bytes):
-        self.calls.append({"key": key, "value": value})
+        self.calls.append(ProducedCall(key, value))
+
+    def poll(self, timeout: float = 0):
+        self.polls += 1
+        return 0
 
     def flush(self, timeout: float = 30.0):
+        self.flushes += 1
         return 0
 
 
 def mock_serializer(data: Dict[str, Any], ctx=None) -> bytes:
     """Mock JSON serializer for testing."""
-    return json.dumps(data).encode("utf-8")
+    return _dumps_bytes(data)
 
 
-def test_normalize_ts_variants():
-    assert ap.normalize_ts("2025-10-18T17:00:00+00:00") == "2025-10-18T17:00:00Z"
-    assert ap.normalize_ts("2025-10-18T17:00:00Z") == "2025-10-18T17:00:00Z"
-    assert ap.normalize_ts("2025-10-18T17:00:00.345Z") == "2025-10-18T17:00:00Z"
-
-
-def test_extract_lat_lon_dict_and_point():
-    lat, lon = ap.extract_lat_lon({"lat": 39.1, "lon": -0.3})
-    assert (lat, lon) == (39.1, -0.3)
-    # POINT (lon lat)
-    lat2, lon2 = ap.extract_lat_lon("POINT (-0.4059 39.4692)")
-    assert pytest.approx(lat2, rel=1e-6) == 39.4692
-    assert pytest.approx(lon2, rel=1e-6) == -0.4059
+@pytest.fixture
+def ap_state(tmp_path, monkeypatch):
+    """Points the air producer's state files and DLQ at tmp_path."""
+    monkeypatch.setattr(ap, "STATE_DIR", str(tmp_path))
+    monkeypatch.setattr(ap, "OFFSET_FILE", str(tmp_path / "offset.txt"))
+    monkeypatch.setattr(ap, "STATE_JSON", str(tmp_path / "state.json"))
+    monkeypatch.setattr(ap, "DLQ_DIR", str(tmp_path / "dlq"))
+    return tmp_path
+
+
+@pytest.fixture
+def fake_fs(monkeypatch):
+    """Replaces the air producer's offset/state persistence with an in-memory dict."""
+    store: Dict[str, Any] = {}
+
+    def load_state():
+        return store.get("offset", ap.START_OFFSET), dict(store.get("seen_for_offset", {}))
+
+    def save_state(offset_iso, seen_map):
+        store["offset"] = offset_iso
+        store["seen_for_offset"] = dict(seen_map)
+
+    monkeypatch.setattr(ap, "load_offset", lambda: store.get("offset", ap.START_OFFSET))
+    monkeypatch.setattr(ap, "save_offset", lambda iso: store.__setitem__("offset", iso))
+    monkeypatch.setattr(ap, "load_state", load_state)
+    monkeypatch.setattr(ap, "save_state", save_state)
+    return store
+
+
+@pytest.mark.parametrize(
+    "raw,expected",
+    [
+        ("2025-10-18T17:00:00+00:00", "2025-10-18T17:00:00Z"),
+        ("2025-10-18T17:00:00Z", "2025-10-18T17:00:00Z"),
+        ("2025-10-18T17:00:00.345Z", "2025-10-18T17:00:00Z"),
+        # Subsecond stripping, with and without a timezone offset
+        ("2025-10-18T17:00:00.123456Z", "2025-10-18T17:00:00Z"),
+        ("2025-10-18T19:00:00.500+02:00", "2025-10-18T17:00:00Z"),
+        # Timestamp without timezone triggers the strptime fallback; only the shape is checked
+        ("2025-10-18T17:00:00", None),
+    ],
+)
+def test_normalize_ts_variants(raw, expected):
+    result = ap.normalize_ts(raw)
+    if expected is None:
+        assert result.endswith("Z")
+        assert "2025-10-18" in result
+    else:
+        assert result == expected
+
+
+@pytest.mark.parametrize(
+    "raw",
+    [
+        # Shaped like a UTC timestamp but not a real date
+        "2025-19-45T99:99:99Z",
+        "2025-02-30T12:00:00.5Z",
+        # Non-ASCII digits
+        "２０２５-10-18T17:00:00Z",
+        "2025-١0-18T17:00:00Z",
+    ],
+)
+def test_normalize_ts_rejects_invalid(raw):
+    """Verifies impossible dates and non-ASCII digits raise instead of passing through unchanged."""
+    with pytest.raises(ValueError):
+        ap.normalize_ts(raw)
+
+
+@pytest.mark.parametrize(
+    "geo,expected",
+    [
+        ({"lat": 39.1, "lon": -0.3}, (39.1, -0.3)),
+        # POINT (lon lat)
+        ("POINT (-0.4059 39.4692)", (39.4692, -0.4059)),
+        # Invalid dict values
+        ({"lat": "invalid", "lon": -0.3}, (None, None)),
+        # Malformed POINT coordinates
+        ("POINT (1.2.3 39.4692)", (None, None)),
+    ],
+)
+def test_extract_lat_lon(geo, expected):
+    lat, lon = ap.extract_lat_lon(geo)
+    if expected[0] is None:
+        assert (lat, lon) == expected
+    else:
+        assert lat == pytest.approx(expected[0], rel=1e-6)
+        assert lon == pytest.approx(expected[1], rel=1e-6)
 
 
 def test_map_record_includes_expected_fields():
-    row = {
-        "fiwareid": "A10_OLIVERETA_60m",
-        "fecha_carg": "2025-10-18T17:00:00+00:00",
-        "so2": None,
-        "no2": 24.0,
-        "o3": None,
-        "co": None,
-        "pm10": 16.0,
-        "pm25": 7.0,
-        "calidad_am": "Buena",
-        "geo_point_2d": {"lat": 39.46924423509195, "lon": -0.40592344552906795},
-    }
-    out = ap.map_record(row, ts_field="fecha_carg")
+    out = ap.map_record(_ROW_OLIVERETA, ts_field="fecha_carg")
     assert out["fiwareid"] == "A10_OLIVERETA_60m"
     assert out["ts"] == "2025-10-18T17:00:00Z"
     assert out["air_quality_summary"] == "Buena"
-    assert "_fp" in out and isinstance(out["_fp"], str) and len(out["_fp"]) == 40
+    # xxh3-128 hex digest, or SHA1 when xxhash is unavailable
+    assert (
+        "_fp" in out
+        and isinstance(out["_fp"], str)
+        and len(out["_fp"]) == (32 if ap.FP_VERSION.startswith("xxh3") else 40)
+    )
 
 
 def test_compute_select_includes_ts_when_missing():
@@ -107,8 +235,8 @@ def test_produce_all_uses_topic_and_key(monkeypatch):
     ap.produce_all(dummy, events, mock_serializer)
     assert len(dummy.calls) == 1
     call = dummy.calls[0]
-    assert call["key"].decode() == "A01|2025-10-18T18:00:00Z"
-    payload = json.loads(call["value"].decode())
+    assert call.key.decode() == "A01|2025-10-18T18:00:00Z"
+    payload = json.loads(call.value.decode())
     assert payload["pm10"] == 10
 
 
@@ -126,44 +254,18 @@ class _FakeResp:
             raise RuntimeError("HTTP error")
 
 
-def test_fetch_since_emits_new_and_advances_offset(monkeypatch, tmp_path):
-    # Arrange state dir
-    monkeypatch.setattr(ap, "STATE_DIR", str(tmp_path), raising=False)
-    monkeypatch.setattr(ap, "OFFSET_FILE", str(tmp_path / "offset.txt"), raising=False)
-    monkeypatch.setattr(ap, "STATE_JSON", str(tmp_path / "state.json"), raising=False)
+def test_fetch_since_emits_new_and_advances_offset(monkeypatch, ap_state):
     monkeypatch.setattr(ap, "LIMIT", 2, raising=False)
 
     offset = "2025-10-18T17:00:00Z"
 
-    page0 = {
-        "total_count": 2,
-        "results": [
-            {
-                "fiwareid": "A01",
-                "fecha_carg": "2025-10-18T18:00:00+00:00",
-                "no2": 10.0,
-                "pm10": 12.0,
-                "pm25": 4.0,
-                "geo_point_2d": {"lat": 39.1, "lon": -0.3},
-            },
-            {
-                "fiwareid": "A02",
-                "fecha_carg": "2025-10-18T18:00:00+00:00",
-                "no2": 20.0,
-                "pm10": 18.0,
-                "pm25": 7.0,
-                "geo_point_2d": {"lat": 39.2, "lon": -0.31},
-            },
-        ],
-    }
-
     def fake_http_request(session, method, url, **kwargs):
         params = kwargs.get("params", {})
         # Only the records endpoint is used in this test
         if "/records" in url:
             # first page returns two rows, next page returns empty
             if params and params.get("offset") == "0":
-                return _FakeResp(page0)
+                return _FakeResp(_PAGE0)
             return _FakeResp({"total_count": 2, "results": []})
         return _FakeResp({}, 404)
 
@@ -183,6 +285,23 @@ def test_fetch_since_emits_new_and_advances_offset(monkeypatch, tmp_path):
     assert len(dummy.calls) == 2
 
 
+def test_produce_all_flush_respects_running_flag(monkeypatch):
+    """Verifies the end-of-batch drain stops polling once running is cleared and hands off to flush."""
+    monkeypatch.setattr(ap, "running", True)
+
+    class StuckProducer(DummyResilientProducer):
+        def poll(self, timeout: float = 0):
+            # Broker never acknowledges; a stop signal arrives during the first drain slice
+            ap.running = False
+            return super().poll(timeout)
+
+    dummy = StuckProducer()
+    dummy.outstanding = 1
+    ap.produce_all(dummy, [{"fiwareid": "A01", "ts": "2025-10-18T18:00:00Z", "_fp": "f"}], mock_serializer)
+    assert dummy.polls == 1
+    assert dummy.flushes == 1
+
+
 def test_produce_all_skips_events_without_ts():
     """Verifies that produce_all skips records without timestamp."""
     dummy = DummyResilientProducer()
@@ -192,7 +311,7 @@ def test_produce_all_skips_events_without_ts():
     ]
     ap.produce_all(dummy, events, mock_serializer)
     assert len(dummy.calls) == 1
-    assert dummy.calls[0]["key"].decode() == "A02|2025-10-18T18:00:00Z"
+    assert dummy.calls[0].key.decode() == "A02|2025-10-18T18:00:00Z"
 
 
 def test_get_meta_success(monkeypatch):
@@ -264,24 +383,16 @@ def test_fetch_one_record_returns_none_on_exception(monkeypatch):
     assert result is None
 
 
-def test_save_offset(tmp_path, monkeypatch):
+@pytest.mark.fs
+def test_save_offset(ap_state, monkeypatch):
     """Verifies save_offset writes to file."""
-    offset_file = tmp_path / "offset.txt"
-    monkeypatch.setattr(ap, "STATE_DIR", str(tmp_path))
-    monkeypatch.setattr(ap, "OFFSET_FILE", str(offset_file))
+    offset_file = ap_state / "offset.txt"
 
     ap.save_offset("2025-10-18T18:00:00Z")
     assert offset_file.exists()
     assert offset_file.read_text() == "2025-10-18T18:00:00Z"
 
 
-def test_extract_lat_lon_invalid_dict():
-    """Verifies extract_lat_lon handles invalid dict values."""
-    lat, lon = ap.extract_lat_lon({"lat": "invalid", "lon": -0.3})
-    assert lat is None
-    assert lon is None
-
-
 def test_map_record_fallback_fiwareid():
     """Verifies map_record uses objectid fallback for fiwareid."""
     row = {
@@ -321,22 +432,10 @@ def test_choose_ts_field_returns_none_when_no_match(monkeypatch):
 
 def test_bootstrap_schema_with_meta(monkeypatch):
     """Verifies bootstrap_schema uses metadata fields."""
-    meta = {
-        "dataset": {
-            "fields": [
-                {"name": "objectid"},
-                {"name": "fiwareid"},
-                {"name": "so2"},
-                {"name": "no2"},
-                {"name": "fecha_carg"},
-                {"name": "geo_point_2d"},
-            ]
-        }
-    }
 
     def fake_http_request(session, method, url, **kwargs):
         if "/records" not in url:
-            return _FakeResp(meta)
+            return _FakeResp(_METADATA_FIELDS)
         return _FakeResp({"results": []})
 
     monkeypatch.setattr(ap, "http_request_with_retry", fake_http_request)
@@ -371,9 +470,8 @@ def test_bootstrap_schema_falls_back_to_sample(monkeypatch):
     assert ts_field == "fecha_carg"
 
 
-def test_fetch_since_handles_api_exception(monkeypatch, tmp_path):
+def test_fetch_since_handles_api_exception(monkeypatch, ap_state):
     """Verifies fetch_since handles API exceptions gracefully."""
-    monkeypatch.setattr(ap, "STATE_DIR", str(tmp_path))
     monkeypatch.setattr(ap, "LIMIT", 10)
 
     def fake_http_request(session, method, url, **kwargs):
@@ -389,9 +487,8 @@ def test_fetch_since_handles_api_exception(monkeypatch, tmp_path):
     assert new_offset == "2025-10-18T17:00:00Z"
 
 
-def test_fetch_since_skips_records_without_ts(monkeypatch, tmp_path):
+def test_fetch_since_skips_records_without_ts(monkeypatch, ap_state):
     """Verifies fetch_since skips records without timestamp."""
-    monkeypatch.setattr(ap, "STATE_DIR", str(tmp_path))
     monkeypatch.setattr(ap, "LIMIT", 10)
 
     page = {
@@ -423,21 +520,20 @@ def test_fetch_since_skips_records_without_ts(monkeypatch, tmp_path):
 class TestLoadOffsetDbBootstrap:
     """Tests for load_offset with PG_BOOTSTRAP enabled."""
 
-    def test_load_offset_from_file_takes_precedence(self, tmp_path, monkeypatch):
+    @pytest.mark.fs
+    def test_load_offset_from_file_takes_precedence(self, ap_state, monkeypatch):
         """Verifies that offset file takes precedence over DB bootstrap."""
-        offset_file = tmp_path / "offset.txt"
+        offset_file = ap_state / "offset.txt"
         offset_file.write_text("2025-10-18T17:00:00Z", encoding="utf-8")
 
-        monkeypatch.setattr(ap, "OFFSET_FILE", str(offset_file))
         monkeypatch.setattr(ap, "PG_BOOTSTRAP", True)
         monkeypatch.setattr(ap, "START_OFFSET", "latest_db")
 
         result = ap.load_offset()
         assert result == "2025-10-18T17:00:00Z"
 
-    def test_load_offset_db_bootstrap_success(self, tmp_path, monkeypatch):
+    def test_load_offset_db_bootstrap_success(self, ap_state, monkeypatch):
         """Verifies DB bootstrap fetches max timestamp from database."""
-        monkeypatch.setattr(ap, "OFFSET_FILE", str(tmp_path / "nonexistent.txt"))
         monkeypatch.setattr(ap, "PG_BOOTSTRAP", True)
         monkeypatch.setattr(ap, "START_OFFSET", "latest_db")
 
@@ -469,19 +565,13 @@ class TestLoadOffsetDbBootstrap:
             def connect(self, **kwargs):
                 return MockConn()
 
-        import sys
-
-        sys.modules["psycopg2"] = MockPsycopg2()
+        monkeypatch.setitem(sys.modules, "psycopg2", MockPsycopg2())
 
         result = ap.load_offset()
         assert result == "2025-10-18T18:00:00Z"
 
-        # Cleaning up
-        del sys.modules["psycopg2"]
-
-    def test_load_offset_db_bootstrap_returns_none(self, tmp_path, monkeypatch):
+    def test_load_offset_db_bootstrap_returns_none(self, ap_state, monkeypatch):
         """Verifies fallback when DB returns None."""
-        monkeypatch.setattr(ap, "OFFSET_FILE", str(tmp_path / "nonexistent.txt"))
         monkeypatch.setattr(ap, "PG_BOOTSTRAP", True)
         monkeypatch.setattr(ap, "START_OFFSET", "latest_db")
 
@@ -512,20 +602,15 @@ class TestLoadOffsetDbBootstrap:
             def connect(self, **kwargs):
                 return MockConn()
 
-        import sys
-
-        sys.modules["psycopg2"] = MockPsycopg2()
+        monkeypatch.setitem(sys.modules, "psycopg2", MockPsycopg2())
         monkeypatch.setattr(ap, "START_OFFSET", "latest_db")
 
         result = ap.load_offset()
         # Should return START_OFFSET since DB returned None
         assert result == "latest_db" or result is not None
 
-        del sys.modules["psycopg2"]
-
-    def test_load_offset_db_bootstrap_exception(self, tmp_path, monkeypatch):
+    def test_load_offset_db_bootstrap_exception(self, ap_state, monkeypatch):
         """Verifies fallback on DB connection exception."""
-        monkeypatch.setattr(ap, "OFFSET_FILE", str(tmp_path / "nonexistent.txt"))
         monkeypatch.setattr(ap, "PG_BOOTSTRAP", True)
         monkeypatch.setattr(ap, "START_OFFSET", "latest_db")
 
@@ -533,18 +618,13 @@ class TestLoadOffsetDbBootstrap:
             def connect(self, **kwargs):
                 raise ConnectionError("DB connection failed")
 
-        import sys
-
-        sys.modules["psycopg2"] = MockPsycopg2()
+        monkeypatch.setitem(sys.modules, "psycopg2", MockPsycopg2())
 
         result = ap.load_offset()
         assert result == "latest_db"  # Falls back to START_OFFSET
 
-        del sys.modules["psycopg2"]
-
-    def test_load_offset_without_db_bootstrap(self, tmp_path, monkeypatch):
+    def test_load_offset_without_db_bootstrap(self, ap_state, monkeypatch):
         """Verifies default offset when PG_BOOTSTRAP is disabled."""
-        monkeypatch.setattr(ap, "OFFSET_FILE", str(tmp_path / "nonexistent.txt"))
         monkeypatch.setattr(ap, "PG_BOOTSTRAP", False)
         monkeypatch.setattr(ap, "START_OFFSET", "1970-01-01T00:00:00Z")
 
@@ -555,14 +635,12 @@ class TestLoadOffsetDbBootstrap:
 class TestLoadStateExceptionHandling:
     """Tests for load_state exception handling."""
 
-    def test_load_state_corrupted_json(self, tmp_path, monkeypatch):
+    @pytest.mark.fs
+    def test_load_state_corrupted_json(self, ap_state, monkeypatch):
         """Verifies load_state handles corrupted JSON gracefully."""
-        state_json = tmp_path / "state.json"
+        state_json = ap_state / "state.json"
         state_json.write_text("{invalid json", encoding="utf-8")
 
-        monkeypatch.setattr(ap, "STATE_DIR", str(tmp_path))
-        monkeypatch.setattr(ap, "STATE_JSON", str(state_json))
-        monkeypatch.setattr(ap, "OFFSET_FILE", str(tmp_path / "offset.txt"))
         monkeypatch.setattr(ap, "START_OFFSET", "1970-01-01T00:00:00Z")
 
         offset, seen = ap.load_state()
@@ -571,28 +649,6 @@ class TestLoadStateExceptionHandling:
         assert seen == {}
 
 
-class TestNormalizeTsFallbackPaths:
-    """Tests for normalize_ts fallback parsing paths."""
-
-    def test_normalize_ts_strptime_fallback(self):
-        """Verifies strptime fallback for non-ISO timestamps."""
-        # Timestamp without timezone that triggers strptime fallback
-        result = ap.normalize_ts("2025-10-18T17:00:00")
-        assert result.endswith("Z")
-        assert "2025-10-18" in result
-
-    def test_normalize_ts_subsecond_stripping(self):
-        """Verifies subsecond stripping for timestamps with milliseconds."""
-        result = ap.normalize_ts("2025-10-18T17:00:00.123456Z")
-        assert result == "2025-10-18T17:00:00Z"
-        assert "." not in result
-
-    def test_normalize_ts_subsecond_with_timezone(self):
-        """Verifies subsecond stripping with timezone offset."""
-        result = ap.normalize_ts("2025-10-18T19:00:00.500+02:00")
-        assert result == "2025-10-18T17:00:00Z"
-
-
 class TestGetFieldsFromMetaException:
     """Tests for get_fields_from_meta exception handling."""
 
@@ -611,30 +667,16 @@ class TestGetFieldsFromMetaException:
 class TestFetchSinceEarlyReturn:
     """Tests for fetch_since early return scenarios."""
 
-    def test_fetch_since_returns_data_on_exception_after_first_page(self, monkeypatch, tmp_path):
+    def test_fetch_since_returns_data_on_exception_after_first_page(self, monkeypatch, ap_state):
         """Verifies fetch_since returns collected data when exception occurs after first page."""
-        monkeypatch.setattr(ap, "STATE_DIR", str(tmp_path))
         monkeypatch.setattr(ap, "LIMIT", 1)  # Force pagination
 
-        page0 = {
-            "results": [
-                {
-                    "fiwareid": "A01",
-                    "fecha_carg": "2025-10-18T18:00:00+00:00",
-                    "no2": 10.0,
-                    "pm10": 12.0,
-                    "pm25": 4.0,
-                    "geo_point_2d": {"lat": 39.1, "lon": -0.3},
-                }
-            ]
-        }
-
         call_count = [0]
 
         def fake_http_request(session, method, url, **kwargs):
             call_count[0] += 1
             if call_count[0] == 1:
-                return _FakeResp(page0)
+                return _FakeResp(_PAGE_A01)
             # Second call (next page) raises exception
             raise ConnectionError("Network error on page 2")
 
@@ -652,38 +694,43 @@ class TestFetchSinceEarlyReturn:
         assert new_offset == "2025-10-18T18:00:00Z"
 
 
+class TestFetchSincePagination:
+    """Tests for fetch_since paging with next-page prefetch."""
+
+    def test_fetch_since_requests_every_page_in_order(self, monkeypatch, ap_state):
+        """Verifies each page is requested once, in order, until a short page ends the base."""
+        monkeypatch.setattr(ap, "LIMIT", 1)
+        pages = {"0": {"results": [_ROW_A01]}, "1": {"results": [_ROW_A02]}, "2": {"results": []}}
+        requested = []
+
+        def fake_http_request(session, method, url, **kwargs):
+            offset = kwargs["params"]["offset"]
+            requested.append(offset)
+            return _FakeResp(pages[offset])
+
+        monkeypatch.setattr(ap, "http_request_with_retry", fake_http_request)
+
+        out, new_offset, seen_map = ap.fetch_since(
+            "2025-10-18T17:00:00Z", {}, ap.BASES, "fiwareid,fecha_carg,no2,geo_point_2d", "fecha_carg"
+        )
+        assert requested == ["0", "1", "2"]
+        assert [ev["fiwareid"] for ev in out] == ["A01", "A02"]
+        assert new_offset == "2025-10-18T18:00:00Z"
+
+
 class TestFetchSinceMaxTsEmission:
     """Tests for fetch_since emission when ts equals max_ts."""
 
-    def test_fetch_since_emits_for_ts_equals_max_ts(self, monkeypatch, tmp_path):
+    def test_fetch_since_emits_for_ts_equals_max_ts(self, monkeypatch, ap_state):
         """Verifies emission for records where ts == max_ts (not offset)."""
-        monkeypatch.setattr(ap, "STATE_DIR", str(tmp_path))
         monkeypatch.setattr(ap, "LIMIT", 10)
 
-        # Two records at same new timestamp (both > offset)
-        page = {
-            "results": [
-                {
-                    "fiwareid": "A01",
-                    "fecha_carg": "2025-10-18T18:00:00+00:00",
-                    "no2": 10.0,
-                    "geo_point_2d": {"lat": 39.1, "lon": -0.3},
-                },
-                {
-                    "fiwareid": "A02",
-                    "fecha_carg": "2025-10-18T18:00:00+00:00",
-                    "no2": 20.0,
-                    "geo_point_2d": {"lat": 39.2, "lon": -0.31},
-                },
-            ]
-        }
-
         call_count = [0]
 
         def fake_http_request(session, method, url, **kwargs):
             call_count[0] += 1
             if call_count[0] == 1:
-                return _FakeResp(page)
+                return _FakeResp(_PAGE0)
             return _FakeResp({"results": []})
 
         monkeypatch.setattr(ap, "http_request_with_retry", fake_http_request)
@@ -725,23 +772,11 @@ class TestBootstrapSchemaFallback:
 class TestMainFunction:
     """Tests for the main() function."""
 
-    def test_main_single_iteration_no_data(self, monkeypatch, tmp_path):
+    def test_main_single_iteration_no_data(self, monkeypatch, ap_state, fake_fs):
         """Verifies main loop handles no-data case."""
-        monkeypatch.setattr(ap, "STATE_DIR", str(tmp_path))
-        monkeypatch.setattr(ap, "STATE_JSON", str(tmp_path / "state.json"))
-        monkeypatch.setattr(ap, "OFFSET_FILE", str(tmp_path / "offset.txt"))
-        monkeypatch.setattr(ap, "DLQ_DIR", str(tmp_path / "dlq"))
         monkeypatch.setattr(ap, "POLL_SECS", 0)  # No sleep
         monkeypatch.setattr(ap, "START_OFFSET", "1970-01-01T00:00:00Z")
 
-        # Mocking to exit after one iteration
-        iteration_count = [0]
-        original_running = ap.running
-
-        def stop_after_one():
-            iteration_count[0] += 1
-            return iteration_count[0] < 2
-
         # Mocking http requests to return empty
         def fake_http_request(session, method, url, **kwargs):
             return _FakeResp({"results": []})
@@ -756,7 +791,7 @@ class TestMainFunction:
             def flush(self, timeout=None):
                 return 0
 
-        monkeypatch.setattr("confluent_kafka.Producer", lambda cfg: MockProducer())
+        monkeypatch.setattr(ap, "Producer", lambda cfg: MockProducer())
 
         # Stopping after bootstrap
         monkeypatch.setattr(ap, "running", False)
@@ -764,40 +799,20 @@ class TestMainFunction:
         # This should not raise and should exit cleanly
         ap.main()
 
-        # Resetting running state
-        ap.running = original_running
-
-    def test_main_with_data_produces_messages(self, monkeypatch, tmp_path, capsys):
+    def test_main_with_data_produces_messages(self, monkeypatch, ap_state, fake_fs, capsys):
         """Verifies main loop produces messages when data is available."""
-        monkeypatch.setattr(ap, "STATE_DIR", str(tmp_path))
-        monkeypatch.setattr(ap, "STATE_JSON", str(tmp_path / "state.json"))
-        monkeypatch.setattr(ap, "OFFSET_FILE", str(tmp_path / "offset.txt"))
-        monkeypatch.setattr(ap, "DLQ_DIR", str(tmp_path / "dlq"))
         monkeypatch.setattr(ap, "POLL_SECS", 0)
         monkeypatch.setattr(ap, "START_OFFSET", "1970-01-01T00:00:00Z")
         monkeypatch.setattr(ap, "LIMIT", 10)
 
-        # Setting up data to return on first fetch
-        page = {
-            "results": [
-                {
-                    "fiwareid": "A01",
-                    "fecha_carg": "2025-10-18T18:00:00+00:00",
-                    "no2": 10.0,
-                    "geo_point_2d": {"lat": 39.1, "lon": -0.3},
-                }
-            ]
-        }
-        meta = {"dataset": {"fields": [{"name": "fiwareid"}, {"name": "fecha_carg"}, {"name": "no2"}]}}
-
         call_count = [0]
 
         def fake_http_request(session, method, url, **kwargs):
             call_count[0] += 1
             if "/records" not in url:
-                return _FakeResp(meta)
+                return _FakeResp(_METADATA_FIELDS)
             if call_count[0] <= 2:
-                return _FakeResp(page)
+                return _FakeResp(_PAGE_A01)
             return _FakeResp({"results": []})
 
         monkeypatch.setattr(ap, "http_request_with_retry", fake_http_request)
@@ -814,10 +829,9 @@ class TestMainFunction:
             def flush(self, timeout=None):
                 return 0
 
-        monkeypatch.setattr("confluent_kafka.Producer", lambda cfg: MockProducer())
+        monkeypatch.setattr(ap, "Producer", lambda cfg: MockProducer())
 
         # Stopping immediately after one iteration
-        original_running = ap.running
         monkeypatch.setattr(ap, "running", False)
 
         ap.main()
@@ -826,14 +840,8 @@ class TestMainFunction:
         captured = capsys.readouterr()
         assert "[air] using ts_field" in captured.out
 
-        ap.running = original_running
-
-    def test_main_handles_exception_gracefully(self, monkeypatch, tmp_path, capsys):
+    def test_main_handles_exception_gracefully(self, monkeypatch, ap_state, fake_fs, capsys):
         """Verifies main loop catches and logs exceptions."""
-        monkeypatch.setattr(ap, "STATE_DIR", str(tmp_path))
-        monkeypatch.setattr(ap, "STATE_JSON", str(tmp_path / "state.json"))
-        monkeypatch.setattr(ap, "OFFSET_FILE", str(tmp_path / "offset.txt"))
-        monkeypatch.setattr(ap, "DLQ_DIR", str(tmp_path / "dlq"))
         monkeypatch.setattr(ap, "POLL_SECS", 0)
         monkeypatch.setattr(ap, "START_OFFSET", "1970-01-01T00:00:00Z")
 
@@ -849,16 +857,13 @@ class TestMainFunction:
             def flush(self, timeout=None):
                 return 0
 
-        monkeypatch.setattr("confluent_kafka.Producer", lambda cfg: MockProducer())
+        monkeypatch.setattr(ap, "Producer", lambda cfg: MockProducer())
 
-        original_running = ap.running
         monkeypatch.setattr(ap, "running", False)
 
         # Should not raise
         ap.main()
 
-        ap.running = original_running
-
 
 class TestStopHandler:
     """Tests for signal handler."""
@@ -868,5 +873,3 @@ class TestStopHandler:
         monkeypatch.setattr(ap, "running", True)
         ap._stop()
         assert ap.running is False
-        # Resetting
-        ap.running = True
@@ -1,13 +1,13 @@
 """Common producer tests: state persistence, fingerprinting, deduplication."""
 
-import sys
-from pathlib import Path
+import json
+import signal
 
+import air_producer as ap
 import pytest
 
-# Make producer modules importable
-sys.path.append(str(Path(__file__).parents[2] / "producer"))
-import air_producer as ap  # noqa: E402
+# Hex digest length for each fingerprint backend; FP_VERSION says which one is active
+FP_HEX_LEN = {"xxh3_128-json": 32, "sha1-json": 40}
 
 
 class TestStatePersistence:
@@ -25,6 +25,8 @@ class TestStatePersistence:
 
         ap.save_state(offset_in, seen_in)
         assert state_json.exists()
+        # Written via a temp file that is renamed into place
+        assert not (tmp_path / "state.json.tmp").exists()
 
         offset_out, seen_out = ap.load_state()
         assert offset_out == offset_in
@@ -41,6 +43,21 @@ class TestStatePersistence:
         assert offset == "1970-01-01T00:00:00Z"
         assert seen == {}
 
+    @pytest.mark.parametrize("fp_version", [None, "sha1-hex"])
+    def test_load_state_discards_seen_from_other_fingerprint_version(self, tmp_path, fp_version, monkeypatch):
+        """Verifies fingerprints saved in another format are dropped while the offset is kept."""
+        state_json = tmp_path / "state.json"
+        monkeypatch.setattr(ap, "STATE_DIR", str(tmp_path))
+        monkeypatch.setattr(ap, "STATE_JSON", str(state_json))
+        state = {"offset": "2025-10-18T18:00:00Z", "seen_for_offset": {"A01": "fp123"}}
+        if fp_version is not None:
+            state["fp_version"] = fp_version
+        state_json.write_text(json.dumps(state), encoding="utf-8")
+
+        offset, seen = ap.load_state()
+        assert offset == "2025-10-18T18:00:00Z"
+        assert seen == {}
+
     def test_load_state_migrates_from_offset_txt(self, tmp_path, monkeypatch):
         """Verifies that load_state can migrate from legacy offset.txt file."""
         offset_file = tmp_path / "offset.txt"
@@ -64,7 +81,7 @@ class TestValueFingerprint:
         fp1 = ap.value_fingerprint(rec)
         fp2 = ap.value_fingerprint(rec)
         assert fp1 == fp2
-        assert isinstance(fp1, str) and len(fp1) == 40  # SHA1 hex
+        assert isinstance(fp1, str) and len(fp1) == FP_HEX_LEN[ap.FP_VERSION]
 
     def test_fingerprint_changes_with_values(self):
         """Verifies that fingerprints change when values change."""
@@ -284,8 +301,6 @@ class TestGracefulShutdown:
         Note: the handler may be from either air_producer or weather_producer
         depending on import order, but both have the same behavior.
         """
-        import signal
-
         handler = signal.getsignal(signal.SIGINT)
         # Verifying handler is a callable named _stop
         assert callable(handler)
@@ -297,8 +312,6 @@ class TestGracefulShutdown:
         Note: the handler may be from either air_producer or weather_producer
         depending on import order, but both have the same behavior.
         """
-        import signal
-
         handler = signal.getsignal(signal.SIGTERM)
         # Verifying handler is a callable named _stop
         assert callable(handler)
@@ -1,21 +1,78 @@
 import json
+import re
 import sys
-from pathlib import Path
-from typing import Any, Dict, List
+from typing import Any, Dict, List, Optional, Tuple
 
 import pytest
-
-# Make producer modules importable
-sys.path.append(str(Path(__file__).parents[2] / "producer"))
-import weather_producer as wp  # noqa: E402
+import weather_producer as wp
+
+try:
+    import orjson
+
+    _loads = orjson.loads
+
+    def _dumps_bytes(data: Dict[str, Any]) -> bytes:
+        return orjson.dumps(data)
+except ImportError:
+    _loads = json.loads
+
+    def _dumps_bytes(data: Dict[str, Any]) -> bytes:
+        return json.dumps(data).encode("utf-8")
+
+
+# Shared read-only API payloads; producer code never mutates the rows it is given
+# W01's change-detection fields, fingerprinted once at import
+_REC_W01_VALUES = {
+    "viento_dir": 180,
+    "viento_vel": 3.2,
+    "temperatur": 22.5,
+    "humedad_re": 55.0,
+    "presion_ba": 1013.2,
+    "precipitac": 0.4,
+}
+_EXPECTED_FP_W01 = wp.value_fingerprint(_REC_W01_VALUES)
+_ROW_W01 = {
+    "fiwareid": "W01",
+    "fecha_carg": "2025-10-18T17:00:00+00:00",
+    "direccion": "CENTRO",
+    **_REC_W01_VALUES,
+    "geo_point_2d": {"lat": 39.47, "lon": -0.38},
+}
+# A later reading for W01, and W02 reporting at the same timestamp
+_ROW_W01_LATER = {
+    "fiwareid": "W01",
+    "fecha_carg": "2025-10-18T18:00:00+00:00",
+    "temperatur": 22.5,
+    "geo_point_2d": {"lat": 39.47, "lon": -0.38},
+}
+_ROW_W02_LATER = {
+    "fiwareid": "W02",
+    "fecha_carg": "2025-10-18T18:00:00+00:00",
+    "temperatur": 23.0,
+    "geo_point_2d": {"lat": 39.48, "lon": -0.39},
+}
+_PAGE_W01 = {"results": [_ROW_W01]}
+_PAGE_W01_LATER = {"results": [_ROW_W01_LATER]}
+_PAGE_EMPTY = {"results": []}
+# Dataset metadata URL, as opposed to its /records endpoint
+_META_URL_RX = r"/datasets/[^/]+$"
+_METADATA_FIELDS = {"dataset": {"fields": [{"name": "fiwareid"}, {"name": "temperatur"}, {"name": "fecha_carg"}]}}
 
 
 class DummyProducer:
     def __init__(self):
-        self.calls: List[Dict[str, Any]] = []
+        self.topics: List[str] = []
+        self.keys: List[bytes] = []
+        self.values: List[bytes] = []
+
+    @property
+    def calls(self) -> List[Dict[str, Any]]:
+        return [{"topic": t, "key": k, "value": v} for t, k, v in zip(self.topics, self.keys, self.values)]
 
     def produce(self, topic: str, key: bytes, value: bytes):
-        self.calls.append({"topic": topic, "key": key, "value": value})
+        self.topics.append(topic)
+        self.keys.append(key)
+        self.values.append(value)
 
     def flush(self):
         return 0
@@ -23,34 +80,89 @@ class DummyProducer:
 
 class DummyResilientProducer:
     def __init__(self):
-        self.calls: List[Dict[str, Any]] = []
+        self.keys: List[bytes] = []
+        self.values: List[bytes] = []
+        self.polls = 0
+        self.flushes = 0
+        self.outstanding = 0
+
+    @property
+    def calls(self) -> List[Dict[str, Any]]:
+        return [{"key": k, "value": v} for k, v in zip(self.keys, self.values)]
+
+    def last(self) -> Tuple[bytes, bytes]:
+        return self.keys[-1], self.values[-1]
 
     def produce(self, key: bytes, value: bytes):
-        self.calls.append({"key": key, "value": value})
+        self.keys.append(key)
+        self.values.append(value)
+
+    def poll(self, timeout: float = 0):
+        self.polls += 1
+        return 0
 
     def flush(self, timeout: float = 30.0):
+        self.flushes += 1
         return 0
 
 
+class _DeliveredMsg:
+    """Minimal confluent_kafka.Message for delivery callbacks."""
+
+    __slots__ = ("_key", "_value")
+
+    def __init__(self, key: bytes, value: bytes):
+        self._key = key
+        self._value = value
+
+    def key(self) -> bytes:
+        return self._key
+
+    def value(self) -> bytes:
+        return self._value
+
+
+class _MockKafkaProducer:
+    """Stand-in for confluent_kafka.Producer; delivery reports queue up and are served by poll/flush."""
+
+    def __init__(self, config: Optional[Dict[str, Any]] = None):
+        self.config = config
+        self.keys: List[bytes] = []
+        self.polls = 0
+        self.flushes = 0
+        self._pending: List[Tuple[bytes, bytes, Any]] = []
+
+    def produce(self, topic, key=None, value=None, callback=None):
+        self.keys.append(key)
+        self._pending.append((key, value, callback))
+
+    def _deliver(self) -> int:
+        pending, self._pending = self._pending, []
+        for key, value, callback in pending:
+            if callback:
+                callback(None, _DeliveredMsg(key, value))
+        return len(pending)
+
+    def poll(self, timeout=None):
+        self.polls += 1
+        return self._deliver()
+
+    def flush(self, timeout=None):
+        self.flushes += 1
+        self._deliver()
+        return 0
+
+    def __len__(self):
+        return len(self._pending)
+
+
 def mock_serializer(data: Dict[str, Any], ctx=None) -> bytes:
     """Mock JSON serializer for testing."""
-    return json.dumps(data).encode("utf-8")
+    return _dumps_bytes(data)
 
 
 def test_weather_map_record_field_renames():
-    row = {
-        "fiwareid": "W01",
-        "fecha_carg": "2025-10-18T17:00:00+00:00",
-        "direccion": "CENTRO",
-        "viento_dir": 180,
-        "viento_vel": 3.2,
-        "temperatur": 22.5,
-        "humedad_re": 55.0,
-        "presion_ba": 1013.2,
-        "precipitac": 0.4,
-        "geo_point_2d": {"lat": 39.47, "lon": -0.38},
-    }
-    out = wp.map_record(row, ts_field="fecha_carg")
+    out = wp.map_record(_ROW_W01, ts_field="fecha_carg")
     assert out["ts"] == "2025-10-18T17:00:00Z"
     assert out["wind_dir_deg"] == 180
     assert out["wind_speed_ms"] == 3.2
@@ -58,26 +170,135 @@ def test_weather_map_record_field_renames():
     assert out["humidity_pct"] == 55.0
     assert out["pressure_hpa"] == 1013.2
     assert out["precip_mm"] == 0.4
-    assert "_fp" in out and isinstance(out["_fp"], str)
+    assert out["_fp"] == _EXPECTED_FP_W01
+
+
+@pytest.mark.parametrize(
+    "events,expected_keys,expected_temps",
+    [
+        (
+            [{"fiwareid": "W01", "ts": "2025-10-18T17:00:00Z", "temperature_c": 22.5, "_fp": "f"}],
+            [b"W01|2025-10-18T17:00:00Z"],
+            [22.5],
+        ),
+        # Records without ts are skipped
+        (
+            [
+                {"fiwareid": "W01", "ts": None, "temperature_c": 22.5, "_fp": "a"},
+                {"fiwareid": "W02", "ts": "2025-10-18T18:00:00Z", "temperature_c": 23.0, "_fp": "b"},
+            ],
+            [b"W02|2025-10-18T18:00:00Z"],
+            [23.0],
+        ),
+    ],
+)
+def test_weather_produce_all(events, expected_keys, expected_temps):
+    """Verifies produce_all keys and serializes each event that has a ts."""
+    dummy = DummyResilientProducer()
+    wp.produce_all(dummy, events, mock_serializer)
+    assert dummy.keys == expected_keys
+    assert [_loads(v)["temperature_c"] for v in dummy.values] == expected_temps
+    assert dummy.flushes == 1
 
 
-def test_weather_produce_all(monkeypatch):
+def test_weather_produce_all_polls_every_n_messages(monkeypatch):
+    """Verifies produce_all serves delivery reports every PRODUCE_POLL_EVERY messages and flushes once."""
+    monkeypatch.setattr(wp, "PRODUCE_POLL_EVERY", 2)
     dummy = DummyResilientProducer()
-    ev = {"fiwareid": "W01", "ts": "2025-10-18T17:00:00Z", "temperature_c": 22.5, "_fp": "f"}
-    wp.produce_all(dummy, [ev], mock_serializer)
-    assert len(dummy.calls) == 1
-    call = dummy.calls[0]
-    assert call["key"].decode() == "W01|2025-10-18T17:00:00Z"
-    payload = json.loads(call["value"].decode())
-    assert payload["temperature_c"] == 22.5
+    events = [{"fiwareid": f"W{i:02d}", "ts": "2025-10-18T18:00:00Z", "_fp": "f"} for i in range(5)]
+    wp.produce_all(dummy, events, mock_serializer)
+    assert len(dummy.keys) == 5
+    assert dummy.polls == 2
+    assert dummy.flushes == 1
+
+
+def test_weather_flush_respects_running_flag(monkeypatch):
+    """Verifies the end-of-batch drain stops polling once running is cleared and hands off to flush."""
+    monkeypatch.setattr(wp, "FLUSH_POLL_INTERVAL_MS", 0)
+    monkeypatch.setattr(wp, "running", True)
+
+    class StuckProducer(DummyResilientProducer):
+        def poll(self, timeout: float = 0):
+            # Broker never acknowledges; a stop signal arrives during the first drain slice
+            wp.running = False
+            return super().poll(timeout)
+
+    dummy = StuckProducer()
+    dummy.outstanding = 1
+    wp.produce_all(dummy, [{"fiwareid": "W01", "ts": "2025-10-18T18:00:00Z", "_fp": "f"}], mock_serializer)
+    assert dummy.polls == 1
+    assert dummy.flushes == 1
+
+
+def test_weather_compression_enabled():
+    """Verifies the producer config compresses batches with lz4 and keeps idempotent delivery."""
+    cfg = wp.producer_config()
+    assert cfg["compression.type"] == "lz4"
+    assert cfg["enable.idempotence"] is True
+    assert cfg["bootstrap.servers"] == wp.BOOTSTRAP
+
+
+def test_weather_produce_all_throughput():
+    """Verifies a backfill-sized batch is produced in full with one flush."""
+    dummy = DummyResilientProducer()
+    events = [
+        {"fiwareid": f"W{i:05d}", "ts": "2025-10-18T18:00:00Z", "temperature_c": 20.0, "_fp": "f"}
+        for i in range(10_000)
+    ]
+    wp.produce_all(dummy, events, mock_serializer)
+    assert len(dummy.keys) == 10_000
+    assert dummy.last()[0] == b"W09999|2025-10-18T18:00:00Z"
+    assert dummy.polls == 10_000 // wp.PRODUCE_POLL_EVERY
+    assert dummy.flushes == 1
+
+
+def _point_state_at(monkeypatch, root):
+    monkeypatch.setattr(wp, "STATE_DIR", str(root))
+    monkeypatch.setattr(wp, "OFFSET_FILE", str(root / "offset.txt"))
+    monkeypatch.setattr(wp, "STATE_JSON", str(root / "state.json"))
+    monkeypatch.setattr(wp, "DLQ_DIR", str(root / "dlq"))
+
+
+@pytest.fixture
+def state_paths(tmp_path, monkeypatch):
+    """Points the weather producer's state files and DLQ at tmp_path."""
+    _point_state_at(monkeypatch, tmp_path)
+    return tmp_path
+
+
+@pytest.fixture
+def wp_config(state_paths, monkeypatch):
+    """Configures the weather producer for one sleep-free main() pass over tmp_path state."""
+    monkeypatch.setattr(wp, "POLL_SECS", 0)
+    monkeypatch.setattr(wp, "START_OFFSET", "1970-01-01T00:00:00Z")
+    monkeypatch.setattr(wp, "LIMIT", 10)
+    monkeypatch.setattr(wp, "FLUSH_POLL_INTERVAL_MS", 0)
+    # Stopping after bootstrap
+    monkeypatch.setattr(wp, "running", False)
+    return state_paths
+
+
+@pytest.fixture
+def empty_state_paths(empty_state_dir, monkeypatch):
+    """Points the weather producer at the shared empty state dir; only for tests that never write state."""
+    _point_state_at(monkeypatch, empty_state_dir)
+    return empty_state_dir
 
 
 class _FakeResp:
     def __init__(self, payload, status_code=200):
         self._payload = payload
+        self._bytes: Optional[bytes] = None
         self.status_code = status_code
         self.ok = status_code == 200
 
+    @property
+    def content(self) -> bytes:
+        # Encoded on first access, then shared by every call a _SequencedResponder replays
+        if self._bytes is None:
+            self._bytes = _dumps_bytes(self._payload)
+        return self._bytes
+
     def json(self):
         return self._payload
 
@@ -86,11 +307,70 @@ class _FakeResp:
             raise RuntimeError("HTTP error")
 
 
-def test_weather_normalize_ts_variants():
+class _SequencedResponder:
+    """Stand-in for http_request_with_retry that replays prepared responses.
+
+    URLs matching a ``routes`` pattern always get that route's response; every other
+    call takes the next entry of ``responses``, repeating the last one once exhausted.
+    Exception instances are raised instead of returned.
+    """
+
+    def __init__(self, responses: List[Any], routes: Optional[Dict[str, Any]] = None):
+        self._responses = responses
+        self._routes = [(re.compile(rx), resp) for rx, resp in (routes or {}).items()]
+        self._next = 0
+
+    def __call__(self, session, method, url, **kwargs):
+        for rx, resp in self._routes:
+            if rx.search(url):
+                break
+        else:
+            resp = self._responses[min(self._next, len(self._responses) - 1)]
+            self._next += 1
+        if isinstance(resp, Exception):
+            raise resp
+        return resp
+
+
+@pytest.mark.parametrize(
+    "raw,expected",
+    [
+        ("2025-10-18T17:00:00+00:00", "2025-10-18T17:00:00Z"),
+        ("2025-10-18T17:00:00Z", "2025-10-18T17:00:00Z"),
+        ("2025-10-18T17:00:00.345Z", "2025-10-18T17:00:00Z"),
+        ("2025-10-18T19:00:00+02:00", "2025-10-18T17:00:00Z"),
+        # Subsecond stripping, with and without a timezone offset
+        ("2025-10-18T17:00:00.123456Z", "2025-10-18T17:00:00Z"),
+        ("2025-10-18T19:00:00.500+02:00", "2025-10-18T17:00:00Z"),
+        # Timestamp without timezone triggers the strptime fallback; only the shape is checked
+        ("2025-10-18T17:00:00", None),
+    ],
+)
+def test_weather_normalize_ts_variants(raw, expected):
     """Verifies timestamp normalization in weather producer."""
-    assert wp.normalize_ts("2025-10-18T17:00:00+00:00") == "2025-10-18T17:00:00Z"
-    assert wp.normalize_ts("2025-10-18T17:00:00Z") == "2025-10-18T17:00:00Z"
-    assert wp.normalize_ts("2025-10-18T17:00:00.345Z") == "2025-10-18T17:00:00Z"
+    result = wp.normalize_ts(raw)
+    if expected is None:
+        assert result.endswith("Z")
+        assert "2025-10-18" in result
+    else:
+        assert result == expected
+
+
+@pytest.mark.parametrize(
+    "raw",
+    [
+        # Shaped like a UTC timestamp but not a real date
+        "2025-19-45T99:99:99Z",
+        "2025-02-30T12:00:00.5Z",
+        # Non-ASCII digits
+        "２０２５-10-18T17:00:00Z",
+        "2025-١0-18T17:00:00Z",
+    ],
+)
+def test_weather_normalize_ts_rejects_invalid(raw):
+    """Verifies impossible dates and non-ASCII digits raise instead of passing through unchanged."""
+    with pytest.raises(ValueError):
+        wp.normalize_ts(raw)
 
 
 def test_weather_extract_lat_lon():
@@ -106,48 +386,75 @@ def test_weather_extract_lat_lon():
 
 def test_weather_value_fingerprint():
     """Verifies fingerprinting in weather producer."""
-    rec1 = {
-        "viento_dir": 180,
-        "viento_vel": 3.2,
-        "temperatur": 22.5,
-        "humedad_re": 55.0,
-        "presion_ba": 1013.2,
-        "precipitac": 0.4,
-    }
-    rec2 = {
-        "viento_dir": 180,
-        "viento_vel": 3.2,
-        "temperatur": 23.0,  # Different temp
-        "humedad_re": 55.0,
-        "presion_ba": 1013.2,
-        "precipitac": 0.4,
-    }
-    fp1 = wp.value_fingerprint(rec1)
-    fp2 = wp.value_fingerprint(rec2)
-    assert fp1 != fp2
-    assert len(fp1) == 40  # SHA1 hex
+    rec2 = {**_REC_W01_VALUES, "temperatur": 23.0}  # Different temp
+    assert wp.value_fingerprint(rec2) != _EXPECTED_FP_W01
+    # xxh3-128 hex digest, or SHA1 when xxhash is unavailable
+    assert len(_EXPECTED_FP_W01) == {"xxh3_128-f64": 32, "sha1-f64": 40}[wp.FP_VERSION]
+
+
+@pytest.mark.parametrize(
+    "changed",
+    [
+        {"precipitac": None},
+        {"precipitac": 0.0},
+        {"viento_dir": "N/D"},  # non-numeric value takes the JSON fallback
+        {"presion_ba": 10**400},  # int too large for a double
+        {"viento_vel": [3.2]},
+    ],
+)
+def test_weather_value_fingerprint_edge_values(changed):
+    """Verifies missing and non-numeric readings fingerprint deterministically and as a change."""
+    rec = {**_REC_W01_VALUES, **changed}
+    assert wp.value_fingerprint(rec) == wp.value_fingerprint(dict(rec))
+    assert wp.value_fingerprint(rec) != _EXPECTED_FP_W01
+
+
+@pytest.mark.parametrize("exc", [OverflowError, TypeError])
+def test_weather_value_fingerprint_falls_back_on_pack_errors(exc, monkeypatch):
+    """Verifies a reading the packer rejects with OverflowError/TypeError takes the JSON fallback instead of raising."""
+
+    def pack(*values):
+        raise exc("cannot pack")
 
+    monkeypatch.setattr(wp, "_FP_PACK", pack)
+    fp = wp.value_fingerprint(_REC_W01_VALUES)
+    assert fp == wp._hexdigest(json.dumps(_REC_W01_VALUES, sort_keys=True, separators=(",", ":")).encode("utf-8"))
 
-def test_weather_save_and_load_state(tmp_path, monkeypatch):
+
+def test_weather_value_fingerprint_missing_is_not_zero():
+    """Verifies a missing reading and a zero reading do not collide."""
+    missing = wp.value_fingerprint({**_REC_W01_VALUES, "precipitac": None})
+    assert missing != wp.value_fingerprint({**_REC_W01_VALUES, "precipitac": 0.0})
+
+
+def test_weather_save_and_load_state(state_paths, monkeypatch):
     """Verifies state persistence in weather producer."""
-    state_json = tmp_path / "state.json"
-    monkeypatch.setattr(wp, "STATE_DIR", str(tmp_path))
-    monkeypatch.setattr(wp, "STATE_JSON", str(state_json))
-    monkeypatch.setattr(wp, "OFFSET_FILE", str(tmp_path / "offset.txt"))
+    state_json = state_paths / "state.json"
 
     wp.save_state("2025-10-18T18:00:00Z", {"W01": "fp123"})
     assert state_json.exists()
+    assert not (state_paths / "state.json.tmp").exists()
 
     offset, seen = wp.load_state()
     assert offset == "2025-10-18T18:00:00Z"
     assert seen == {"W01": "fp123"}
 
 
-def test_weather_load_state_default(tmp_path, monkeypatch):
+@pytest.mark.parametrize("fp_version", [None, "sha1-json"])
+def test_weather_load_state_discards_seen_from_other_fingerprint_version(state_paths, fp_version):
+    """Verifies fingerprints saved in another format are dropped while the offset is kept."""
+    state = {"offset": "2025-10-18T18:00:00Z", "seen_for_offset": {"W01": "fp123"}}
+    if fp_version is not None:
+        state["fp_version"] = fp_version
+    (state_paths / "state.json").write_text(json.dumps(state), encoding="utf-8")
+
+    offset, seen = wp.load_state()
+    assert offset == "2025-10-18T18:00:00Z"
+    assert seen == {}
+
+
+def test_weather_load_state_default(empty_state_paths, monkeypatch):
     """Verifies default state when no file exists."""
-    monkeypatch.setattr(wp, "STATE_DIR", str(tmp_path))
-    monkeypatch.setattr(wp, "STATE_JSON", str(tmp_path / "state.json"))
-    monkeypatch.setattr(wp, "OFFSET_FILE", str(tmp_path / "offset.txt"))
     monkeypatch.setattr(wp, "START_OFFSET", "1970-01-01T00:00:00Z")
 
     offset, seen = wp.load_state()
@@ -155,11 +462,9 @@ def test_weather_load_state_default(tmp_path, monkeypatch):
     assert seen == {}
 
 
-def test_weather_save_offset(tmp_path, monkeypatch):
+def test_weather_save_offset(state_paths, monkeypatch):
     """Verifies save_offset in weather producer."""
-    offset_file = tmp_path / "offset.txt"
-    monkeypatch.setattr(wp, "STATE_DIR", str(tmp_path))
-    monkeypatch.setattr(wp, "OFFSET_FILE", str(offset_file))
+    offset_file = state_paths / "offset.txt"
 
     wp.save_offset("2025-10-18T18:00:00Z")
     assert offset_file.exists()
@@ -168,34 +473,36 @@ def test_weather_save_offset(tmp_path, monkeypatch):
 
 def test_weather_get_meta_success(monkeypatch):
     """Verifies get_meta returns parsed JSON on success."""
-    meta = {"dataset": {"fields": [{"name": "temperatur"}]}}
-
-    def fake_http_request(session, method, url, **kwargs):
-        return _FakeResp(meta)
-
-    monkeypatch.setattr(wp, "http_request_with_retry", fake_http_request)
+    monkeypatch.setattr(wp, "http_request_with_retry", _SequencedResponder([_FakeResp(_METADATA_FIELDS)]))
     result = wp.get_meta("https://example.com/api")
-    assert result == meta
+    assert result == _METADATA_FIELDS
 
 
 def test_weather_get_meta_failure(monkeypatch):
     """Verifies get_meta returns None on failure."""
-
-    def fake_http_request(session, method, url, **kwargs):
-        return _FakeResp({}, 500)
-
-    monkeypatch.setattr(wp, "http_request_with_retry", fake_http_request)
+    monkeypatch.setattr(wp, "http_request_with_retry", _SequencedResponder([_FakeResp({}, 500)]))
     assert wp.get_meta("https://example.com/api") is None
 
 
 def test_weather_get_meta_exception(monkeypatch):
     """Verifies get_meta returns None on exception."""
+    monkeypatch.setattr(wp, "http_request_with_retry", _SequencedResponder([ConnectionError("Network error")]))
+    assert wp.get_meta("https://example.com/api") is None
+
+
+def test_weather_session_reuse(monkeypatch):
+    """Verifies every request goes through the one pooled module session."""
+    seen_sessions = []
 
     def fake_http_request(session, method, url, **kwargs):
-        raise ConnectionError("Network error")
+        seen_sessions.append(session)
+        return _FakeResp(_METADATA_FIELDS)
 
     monkeypatch.setattr(wp, "http_request_with_retry", fake_http_request)
-    assert wp.get_meta("https://example.com/api") is None
+    wp.get_meta("https://example.com/api")
+    wp.get_meta("https://example.com/api")
+    assert seen_sessions == [wp.session, wp.session]
+    assert wp.session.get_adapter("https://example.com").max_retries.total == 0
 
 
 def test_weather_get_fields_from_meta():
@@ -220,33 +527,20 @@ def test_weather_get_fields_from_meta_empty():
 
 def test_weather_fetch_one_record_success(monkeypatch):
     """Verifies fetch_one_record returns a record."""
-    record = {"fiwareid": "W01", "fecha_carg": "2025-10-18T17:00:00Z"}
-
-    def fake_http_request(session, method, url, **kwargs):
-        return _FakeResp({"results": [record]})
-
-    monkeypatch.setattr(wp, "http_request_with_retry", fake_http_request)
+    monkeypatch.setattr(wp, "http_request_with_retry", _SequencedResponder([_FakeResp(_PAGE_W01)]))
     result = wp.fetch_one_record("https://example.com/api")
-    assert result == record
+    assert result == _ROW_W01
 
 
 def test_weather_fetch_one_record_empty(monkeypatch):
     """Verifies fetch_one_record returns None when empty."""
-
-    def fake_http_request(session, method, url, **kwargs):
-        return _FakeResp({"results": []})
-
-    monkeypatch.setattr(wp, "http_request_with_retry", fake_http_request)
+    monkeypatch.setattr(wp, "http_request_with_retry", _SequencedResponder([_FakeResp(_PAGE_EMPTY)]))
     assert wp.fetch_one_record("https://example.com/api") is None
 
 
 def test_weather_fetch_one_record_exception(monkeypatch):
     """Verifies fetch_one_record returns None on exception."""
-
-    def fake_http_request(session, method, url, **kwargs):
-        raise ConnectionError("Network error")
-
-    monkeypatch.setattr(wp, "http_request_with_retry", fake_http_request)
+    monkeypatch.setattr(wp, "http_request_with_retry", _SequencedResponder([ConnectionError("Network error")]))
     assert wp.fetch_one_record("https://example.com/api") is None
 
 
@@ -282,32 +576,13 @@ def test_weather_compute_select():
     assert "temperatur" in sel.split(",")
 
 
-def test_weather_fetch_since(monkeypatch, tmp_path):
+def test_weather_fetch_since(monkeypatch, state_paths):
     """Verifies fetch_since returns records and advances offset."""
-    monkeypatch.setattr(wp, "STATE_DIR", str(tmp_path))
     monkeypatch.setattr(wp, "LIMIT", 10)
 
-    page = {
-        "results": [
-            {
-                "fiwareid": "W01",
-                "fecha_carg": "2025-10-18T18:00:00+00:00",
-                "temperatur": 22.5,
-                "humedad_re": 55.0,
-                "geo_point_2d": {"lat": 39.47, "lon": -0.38},
-            }
-        ]
-    }
-
-    call_count = [0]
-
-    def fake_http_request(session, method, url, **kwargs):
-        call_count[0] += 1
-        if call_count[0] == 1:
-            return _FakeResp(page)
-        return _FakeResp({"results": []})
-
-    monkeypatch.setattr(wp, "http_request_with_retry", fake_http_request)
+    monkeypatch.setattr(
+        wp, "http_request_with_retry", _SequencedResponder([_FakeResp(_PAGE_W01_LATER), _FakeResp(_PAGE_EMPTY)])
+    )
 
     out, new_offset, seen_map = wp.fetch_since(
         "2025-10-18T17:00:00Z", {}, wp.BASES, "fiwareid,fecha_carg,temperatur,humedad_re,geo_point_2d", "fecha_carg"
@@ -317,15 +592,10 @@ def test_weather_fetch_since(monkeypatch, tmp_path):
     assert "W01" in seen_map
 
 
-def test_weather_fetch_since_exception(monkeypatch, tmp_path):
+def test_weather_fetch_since_exception(monkeypatch, state_paths):
     """Verifies fetch_since handles exceptions."""
-    monkeypatch.setattr(wp, "STATE_DIR", str(tmp_path))
     monkeypatch.setattr(wp, "LIMIT", 10)
-
-    def fake_http_request(session, method, url, **kwargs):
-        raise ConnectionError("Network error")
-
-    monkeypatch.setattr(wp, "http_request_with_retry", fake_http_request)
+    monkeypatch.setattr(wp, "http_request_with_retry", _SequencedResponder([ConnectionError("Network error")]))
 
     out, new_offset, seen_map = wp.fetch_since(
         "2025-10-18T17:00:00Z", {}, wp.BASES, "fiwareid,fecha_carg", "fecha_carg"
@@ -336,22 +606,8 @@ def test_weather_fetch_since_exception(monkeypatch, tmp_path):
 
 def test_weather_bootstrap_schema(monkeypatch):
     """Verifies bootstrap_schema returns select and ts_field."""
-    meta = {
-        "dataset": {
-            "fields": [
-                {"name": "fiwareid"},
-                {"name": "temperatur"},
-                {"name": "fecha_carg"},
-            ]
-        }
-    }
-
-    def fake_http_request(session, method, url, **kwargs):
-        if "/records" not in url:
-            return _FakeResp(meta)
-        return _FakeResp({"results": []})
-
-    monkeypatch.setattr(wp, "http_request_with_retry", fake_http_request)
+    responder = _SequencedResponder([_FakeResp(_PAGE_EMPTY)], routes={_META_URL_RX: _FakeResp(_METADATA_FIELDS)})
+    monkeypatch.setattr(wp, "http_request_with_retry", responder)
     monkeypatch.setattr(wp, "TIMESTAMP_FIELD", "fecha_carg")
 
     select, ts_field = wp.bootstrap_schema()
@@ -361,39 +617,14 @@ def test_weather_bootstrap_schema(monkeypatch):
 
 def test_weather_bootstrap_schema_fallback_to_sample(monkeypatch):
     """Verifies bootstrap_schema uses sample when meta fails."""
-    sample = {
-        "fiwareid": "W01",
-        "temperatur": 22.5,
-        "fecha_carg": "2025-10-18T17:00:00Z",
-    }
-
-    call_count = [0]
-
-    def fake_http_request(session, method, url, **kwargs):
-        call_count[0] += 1
-        if "/records" in url:
-            return _FakeResp({"results": [sample]})
-        return _FakeResp({}, 404)
-
-    monkeypatch.setattr(wp, "http_request_with_retry", fake_http_request)
+    responder = _SequencedResponder([_FakeResp(_PAGE_W01)], routes={_META_URL_RX: _FakeResp({}, 404)})
+    monkeypatch.setattr(wp, "http_request_with_retry", responder)
     monkeypatch.setattr(wp, "TIMESTAMP_FIELD", "fecha_carg")
 
     select, ts_field = wp.bootstrap_schema()
     assert ts_field == "fecha_carg"
 
 
-def test_weather_produce_all_skips_no_ts():
-    """Verifies produce_all skips records without ts."""
-    dummy = DummyResilientProducer()
-    events = [
-        {"fiwareid": "W01", "ts": None, "temperature_c": 22.5, "_fp": "a"},
-        {"fiwareid": "W02", "ts": "2025-10-18T18:00:00Z", "temperature_c": 23.0, "_fp": "b"},
-    ]
-    wp.produce_all(dummy, events, mock_serializer)
-    assert len(dummy.calls) == 1
-    assert dummy.calls[0]["key"].decode() == "W02|2025-10-18T18:00:00Z"
-
-
 def test_weather_extract_lat_lon_invalid():
     """Verifies extract_lat_lon handles invalid input."""
     lat, lon = wp.extract_lat_lon({"lat": "invalid", "lon": -0.3})
@@ -404,6 +635,10 @@ def test_weather_extract_lat_lon_invalid():
     assert lat2 is None
     assert lon2 is None
 
+    # Malformed WKT decimals no longer reach float()
+    assert wp.extract_lat_lon("POINT (1.2.3 39.47)") == (None, None)
+    assert wp.extract_lat_lon({"lon": -0.38}) == (None, None)
+
 
 def test_weather_map_record_fallback_fiwareid():
     """Verifies map_record uses objectid fallback."""
@@ -426,14 +661,11 @@ def test_weather_map_record_missing_ts():
     assert out["ts"] is None
 
 
-def test_weather_load_state_exception(tmp_path, monkeypatch):
+def test_weather_load_state_exception(state_paths, monkeypatch):
     """Verifies load_state handles corrupted JSON gracefully."""
-    state_json = tmp_path / "state.json"
+    state_json = state_paths / "state.json"
     state_json.write_text("invalid json{{", encoding="utf-8")
 
-    monkeypatch.setattr(wp, "STATE_DIR", str(tmp_path))
-    monkeypatch.setattr(wp, "STATE_JSON", str(state_json))
-    monkeypatch.setattr(wp, "OFFSET_FILE", str(tmp_path / "offset.txt"))
     monkeypatch.setattr(wp, "START_OFFSET", "1970-01-01T00:00:00Z")
 
     offset, seen = wp.load_state()
@@ -441,13 +673,6 @@ def test_weather_load_state_exception(tmp_path, monkeypatch):
     assert seen == {}
 
 
-def test_weather_normalize_ts_fallback():
-    """Verifies normalize_ts handles edge case timestamps."""
-    # Timestamp with timezone offset
-    result = wp.normalize_ts("2025-10-18T19:00:00+02:00")
-    assert result == "2025-10-18T17:00:00Z"
-
-
 def test_weather_choose_ts_field_returns_env_when_auto_disabled(monkeypatch):
     """Verifies choose_ts_field returns env value when AUTO_TS_FIELD is false."""
     monkeypatch.setattr(wp, "TIMESTAMP_FIELD", "custom_ts")
@@ -464,50 +689,17 @@ def test_weather_choose_ts_field_returns_none(monkeypatch):
     assert result is None
 
 
-def test_weather_fetch_since_deduplication(monkeypatch, tmp_path):
+def test_weather_fetch_since_deduplication(monkeypatch, state_paths):
     """Verifies fetch_since deduplication with same timestamp."""
-    monkeypatch.setattr(wp, "STATE_DIR", str(tmp_path))
     monkeypatch.setattr(wp, "LIMIT", 10)
 
-    # Create fingerprint for the expected record
-    rec_values = {
-        "viento_dir": 180,
-        "viento_vel": 3.2,
-        "temperatur": 22.5,
-        "humedad_re": 55.0,
-        "presion_ba": 1013.2,
-        "precipitac": 0.4,
-    }
-    expected_fp = wp.value_fingerprint(rec_values)
-
-    page = {
-        "results": [
-            {
-                "fiwareid": "W01",
-                "fecha_carg": "2025-10-18T17:00:00+00:00",  # Same as offset
-                "viento_dir": 180,
-                "viento_vel": 3.2,
-                "temperatur": 22.5,
-                "humedad_re": 55.0,
-                "presion_ba": 1013.2,
-                "precipitac": 0.4,
-                "geo_point_2d": {"lat": 39.47, "lon": -0.38},
-            }
-        ]
-    }
-
-    call_count = [0]
-
-    def fake_http_request(session, method, url, **kwargs):
-        call_count[0] += 1
-        if call_count[0] == 1:
-            return _FakeResp(page)
-        return _FakeResp({"results": []})
-
-    monkeypatch.setattr(wp, "http_request_with_retry", fake_http_request)
+    # Same ts as offset
+    monkeypatch.setattr(
+        wp, "http_request_with_retry", _SequencedResponder([_FakeResp(_PAGE_W01), _FakeResp(_PAGE_EMPTY)])
+    )
 
     # Already seen this station with same fingerprint
-    seen_for_offset = {"W01": expected_fp}
+    seen_for_offset = {"W01": _EXPECTED_FP_W01}
 
     out, new_offset, seen_map = wp.fetch_since(
         "2025-10-18T17:00:00Z",
@@ -520,36 +712,14 @@ def test_weather_fetch_since_deduplication(monkeypatch, tmp_path):
     assert len(out) == 0
 
 
-def test_weather_fetch_since_emits_changed_value(monkeypatch, tmp_path):
+def test_weather_fetch_since_emits_changed_value(monkeypatch, state_paths):
     """Verifies fetch_since emits when values change at same timestamp."""
-    monkeypatch.setattr(wp, "STATE_DIR", str(tmp_path))
     monkeypatch.setattr(wp, "LIMIT", 10)
 
-    page = {
-        "results": [
-            {
-                "fiwareid": "W01",
-                "fecha_carg": "2025-10-18T17:00:00+00:00",  # Same as offset
-                "viento_dir": 180,
-                "viento_vel": 5.0,  # Changed value
-                "temperatur": 22.5,
-                "humedad_re": 55.0,
-                "presion_ba": 1013.2,
-                "precipitac": 0.4,
-                "geo_point_2d": {"lat": 39.47, "lon": -0.38},
-            }
-        ]
-    }
+    # Same ts as offset, changed wind speed
+    page = {"results": [{**_ROW_W01, "viento_vel": 5.0}]}
 
-    call_count = [0]
-
-    def fake_http_request(session, method, url, **kwargs):
-        call_count[0] += 1
-        if call_count[0] == 1:
-            return _FakeResp(page)
-        return _FakeResp({"results": []})
-
-    monkeypatch.setattr(wp, "http_request_with_retry", fake_http_request)
+    monkeypatch.setattr(wp, "http_request_with_retry", _SequencedResponder([_FakeResp(page), _FakeResp(_PAGE_EMPTY)]))
 
     # Old fingerprint doesn't match
     seen_for_offset = {"W01": "old_fingerprint_123"}
@@ -567,33 +737,24 @@ def test_weather_fetch_since_emits_changed_value(monkeypatch, tmp_path):
 
 def test_weather_bootstrap_schema_no_ts_field(monkeypatch):
     """Verifies bootstrap_schema falls back to TIMESTAMP_FIELD when none found."""
-
-    def fake_http_request(session, method, url, **kwargs):
-        return _FakeResp({}, 404)  # All requests fail
-
-    monkeypatch.setattr(wp, "http_request_with_retry", fake_http_request)
+    monkeypatch.setattr(wp, "http_request_with_retry", _SequencedResponder([_FakeResp({}, 404)]))
     monkeypatch.setattr(wp, "TIMESTAMP_FIELD", "fecha_carg")
 
     select, ts_field = wp.bootstrap_schema()
     assert ts_field == "fecha_carg"
 
 
-def test_weather_load_offset_from_file(tmp_path, monkeypatch):
+def test_weather_load_offset_from_file(state_paths, monkeypatch):
     """Verifies load_offset reads from offset.txt file."""
-    offset_file = tmp_path / "offset.txt"
+    offset_file = state_paths / "offset.txt"
     offset_file.write_text("2025-10-18T17:00:00Z", encoding="utf-8")
 
-    monkeypatch.setattr(wp, "STATE_DIR", str(tmp_path))
-    monkeypatch.setattr(wp, "OFFSET_FILE", str(offset_file))
-
     result = wp.load_offset()
     assert result == "2025-10-18T17:00:00Z"
 
 
-def test_weather_load_offset_default(tmp_path, monkeypatch):
+def test_weather_load_offset_default(empty_state_paths, monkeypatch):
     """Verifies load_offset returns default when no file exists."""
-    monkeypatch.setattr(wp, "STATE_DIR", str(tmp_path))
-    monkeypatch.setattr(wp, "OFFSET_FILE", str(tmp_path / "offset.txt"))
     monkeypatch.setattr(wp, "START_OFFSET", "1970-01-01T00:00:00Z")
     monkeypatch.setattr(wp, "PG_BOOTSTRAP", False)
 
@@ -601,9 +762,8 @@ def test_weather_load_offset_default(tmp_path, monkeypatch):
     assert result == "1970-01-01T00:00:00Z"
 
 
-def test_weather_fetch_since_skips_records_without_ts(monkeypatch, tmp_path):
+def test_weather_fetch_since_skips_records_without_ts(monkeypatch, state_paths):
     """Verifies fetch_since skips records without timestamp."""
-    monkeypatch.setattr(wp, "STATE_DIR", str(tmp_path))
     monkeypatch.setattr(wp, "LIMIT", 10)
 
     page = {
@@ -612,15 +772,7 @@ def test_weather_fetch_since_skips_records_without_ts(monkeypatch, tmp_path):
         ]
     }
 
-    call_count = [0]
-
-    def fake_http_request(session, method, url, **kwargs):
-        call_count[0] += 1
-        if call_count[0] == 1:
-            return _FakeResp(page)
-        return _FakeResp({"results": []})
-
-    monkeypatch.setattr(wp, "http_request_with_retry", fake_http_request)
+    monkeypatch.setattr(wp, "http_request_with_retry", _SequencedResponder([_FakeResp(page), _FakeResp(_PAGE_EMPTY)]))
 
     out, new_offset, seen_map = wp.fetch_since(
         "2025-10-18T17:00:00Z", {}, wp.BASES, "fiwareid,fecha_carg", "fecha_carg"
@@ -642,21 +794,19 @@ def test_weather_get_fields_from_meta_exception():
 class TestWeatherLoadOffsetDbBootstrap:
     """Tests for load_offset with PG_BOOTSTRAP enabled."""
 
-    def test_load_offset_from_file_takes_precedence(self, tmp_path, monkeypatch):
+    def test_load_offset_from_file_takes_precedence(self, state_paths, monkeypatch):
         """Verifies that offset file takes precedence over DB bootstrap."""
-        offset_file = tmp_path / "offset.txt"
+        offset_file = state_paths / "offset.txt"
         offset_file.write_text("2025-10-18T17:00:00Z", encoding="utf-8")
 
-        monkeypatch.setattr(wp, "OFFSET_FILE", str(offset_file))
         monkeypatch.setattr(wp, "PG_BOOTSTRAP", True)
         monkeypatch.setattr(wp, "START_OFFSET", "latest_db")
 
         result = wp.load_offset()
         assert result == "2025-10-18T17:00:00Z"
 
-    def test_load_offset_db_bootstrap_success(self, tmp_path, monkeypatch):
+    def test_load_offset_db_bootstrap_success(self, empty_state_paths, monkeypatch):
         """Verifies DB bootstrap fetches max timestamp from database."""
-        monkeypatch.setattr(wp, "OFFSET_FILE", str(tmp_path / "nonexistent.txt"))
         monkeypatch.setattr(wp, "PG_BOOTSTRAP", True)
         monkeypatch.setattr(wp, "START_OFFSET", "latest_db")
 
@@ -687,18 +837,13 @@ class TestWeatherLoadOffsetDbBootstrap:
             def connect(self, **kwargs):
                 return MockConn()
 
-        import sys
-
-        sys.modules["psycopg2"] = MockPsycopg2()
+        monkeypatch.setitem(sys.modules, "psycopg2", MockPsycopg2())
 
         result = wp.load_offset()
         assert result == "2025-10-18T18:00:00Z"
 
-        del sys.modules["psycopg2"]
-
-    def test_load_offset_db_bootstrap_exception(self, tmp_path, monkeypatch):
+    def test_load_offset_db_bootstrap_exception(self, empty_state_paths, monkeypatch):
         """Verifies fallback on DB connection exception."""
-        monkeypatch.setattr(wp, "OFFSET_FILE", str(tmp_path / "nonexistent.txt"))
         monkeypatch.setattr(wp, "PG_BOOTSTRAP", True)
         monkeypatch.setattr(wp, "START_OFFSET", "latest_db")
 
@@ -706,18 +851,13 @@ class TestWeatherLoadOffsetDbBootstrap:
             def connect(self, **kwargs):
                 raise ConnectionError("DB connection failed")
 
-        import sys
-
-        sys.modules["psycopg2"] = MockPsycopg2()
+        monkeypatch.setitem(sys.modules, "psycopg2", MockPsycopg2())
 
         result = wp.load_offset()
         assert result == "latest_db"
 
-        del sys.modules["psycopg2"]
-
-    def test_load_offset_db_bootstrap_returns_none(self, tmp_path, monkeypatch):
+    def test_load_offset_db_bootstrap_returns_none(self, empty_state_paths, monkeypatch):
         """Verifies fallback when DB returns None."""
-        monkeypatch.setattr(wp, "OFFSET_FILE", str(tmp_path / "nonexistent.txt"))
         monkeypatch.setattr(wp, "PG_BOOTSTRAP", True)
         monkeypatch.setattr(wp, "START_OFFSET", "latest_db")
 
@@ -748,36 +888,12 @@ class TestWeatherLoadOffsetDbBootstrap:
             def connect(self, **kwargs):
                 return MockConn()
 
-        import sys
-
-        sys.modules["psycopg2"] = MockPsycopg2()
+        monkeypatch.setitem(sys.modules, "psycopg2", MockPsycopg2())
 
         result = wp.load_offset()
         # Should return START_OFFSET since DB returned None
         assert result == "latest_db" or result is not None
 
-        del sys.modules["psycopg2"]
-
-
-class TestWeatherNormalizeTsFallbackPaths:
-    """Tests for normalize_ts fallback parsing paths."""
-
-    def test_normalize_ts_strptime_fallback(self):
-        """Verifies strptime fallback for non-ISO timestamps."""
-        result = wp.normalize_ts("2025-10-18T17:00:00")
-        assert result.endswith("Z")
-        assert "2025-10-18" in result
-
-    def test_normalize_ts_subsecond_stripping(self):
-        """Verifies subsecond stripping for timestamps with milliseconds."""
-        result = wp.normalize_ts("2025-10-18T17:00:00.123456Z")
-        assert result == "2025-10-18T17:00:00Z"
-
-    def test_normalize_ts_subsecond_with_timezone(self):
-        """Verifies subsecond stripping with timezone offset."""
-        result = wp.normalize_ts("2025-10-18T19:00:00.500+02:00")
-        assert result == "2025-10-18T17:00:00Z"
-
 
 class TestWeatherGetFieldsFromMetaException:
     """Tests for get_fields_from_meta exception handling."""
@@ -791,31 +907,15 @@ class TestWeatherGetFieldsFromMetaException:
 class TestWeatherFetchSinceEarlyReturn:
     """Tests for fetch_since early return scenarios."""
 
-    def test_fetch_since_returns_data_on_exception_after_first_page(self, monkeypatch, tmp_path):
+    def test_fetch_since_returns_data_on_exception_after_first_page(self, monkeypatch, state_paths):
         """Verifies fetch_since returns collected data when exception occurs after first page."""
-        monkeypatch.setattr(wp, "STATE_DIR", str(tmp_path))
         monkeypatch.setattr(wp, "LIMIT", 1)
 
-        page0 = {
-            "results": [
-                {
-                    "fiwareid": "W01",
-                    "fecha_carg": "2025-10-18T18:00:00+00:00",
-                    "temperatur": 22.5,
-                    "geo_point_2d": {"lat": 39.47, "lon": -0.38},
-                }
-            ]
-        }
-
-        call_count = [0]
-
-        def fake_http_request(session, method, url, **kwargs):
-            call_count[0] += 1
-            if call_count[0] == 1:
-                return _FakeResp(page0)
-            raise ConnectionError("Network error on page 2")
-
-        monkeypatch.setattr(wp, "http_request_with_retry", fake_http_request)
+        monkeypatch.setattr(
+            wp,
+            "http_request_with_retry",
+            _SequencedResponder([_FakeResp(_PAGE_W01_LATER), ConnectionError("Network error on page 2")]),
+        )
 
         out, new_offset, seen_map = wp.fetch_since(
             "2025-10-18T17:00:00Z",
@@ -828,40 +928,57 @@ class TestWeatherFetchSinceEarlyReturn:
         assert new_offset == "2025-10-18T18:00:00Z"
 
 
+class TestWeatherFetchSincePagination:
+    """Tests for fetch_since paging with next-page prefetch."""
+
+    def test_fetch_since_requests_every_page_in_order(self, monkeypatch, state_paths):
+        """Verifies each page is requested once, in order, until an empty page ends the base."""
+        monkeypatch.setattr(wp, "LIMIT", 1)
+        pages = {"0": {"results": [_ROW_W01_LATER]}, "1": {"results": [_ROW_W02_LATER]}, "2": _PAGE_EMPTY}
+        requested = []
+
+        def fake_http_request(session, method, url, **kwargs):
+            offset = kwargs["params"]["offset"]
+            requested.append(offset)
+            return _FakeResp(pages[offset])
+
+        monkeypatch.setattr(wp, "http_request_with_retry", fake_http_request)
+
+        out, new_offset, seen_map = wp.fetch_since(
+            "2025-10-18T17:00:00Z", {}, wp.BASES, "fiwareid,fecha_carg,temperatur,geo_point_2d", "fecha_carg"
+        )
+        assert requested == ["0", "1", "2"]
+        assert [ev["fiwareid"] for ev in out] == ["W01", "W02"]
+        assert new_offset == "2025-10-18T18:00:00Z"
+
+
+class TestWeatherFetchPage:
+    """Tests for _fetch_page response decoding."""
+
+    def test_fetch_page_parses_raw_body(self, monkeypatch):
+        """Verifies pages are decoded from the response bytes rather than through Response.json()."""
+
+        class BodyOnlyResp(_FakeResp):
+            def json(self):
+                raise AssertionError("_fetch_page should parse resp.content")
+
+        monkeypatch.setattr(wp, "http_request_with_retry", _SequencedResponder([BodyOnlyResp(_PAGE_W01_LATER)]))
+        rows = wp._fetch_page(wp.BASES[0], 0, "2025-10-18T17:00:00Z", "fiwareid,fecha_carg", "fecha_carg")
+        assert rows == [_ROW_W01_LATER]
+
+
 class TestWeatherFetchSinceMaxTsEmission:
     """Tests for fetch_since emission when ts equals max_ts."""
 
-    def test_fetch_since_emits_for_ts_equals_max_ts(self, monkeypatch, tmp_path):
+    def test_fetch_since_emits_for_ts_equals_max_ts(self, monkeypatch, state_paths):
         """Verifies emission for records where ts == max_ts (not offset)."""
-        monkeypatch.setattr(wp, "STATE_DIR", str(tmp_path))
         monkeypatch.setattr(wp, "LIMIT", 10)
 
-        page = {
-            "results": [
-                {
-                    "fiwareid": "W01",
-                    "fecha_carg": "2025-10-18T18:00:00+00:00",
-                    "temperatur": 22.5,
-                    "geo_point_2d": {"lat": 39.47, "lon": -0.38},
-                },
-                {
-                    "fiwareid": "W02",
-                    "fecha_carg": "2025-10-18T18:00:00+00:00",
-                    "temperatur": 23.0,
-                    "geo_point_2d": {"lat": 39.48, "lon": -0.39},
-                },
-            ]
-        }
+        page = {"results": [_ROW_W01_LATER, _ROW_W02_LATER]}
 
-        call_count = [0]
-
-        def fake_http_request(session, method, url, **kwargs):
-            call_count[0] += 1
-            if call_count[0] == 1:
-                return _FakeResp(page)
-            return _FakeResp({"results": []})
-
-        monkeypatch.setattr(wp, "http_request_with_retry", fake_http_request)
+        monkeypatch.setattr(
+            wp, "http_request_with_retry", _SequencedResponder([_FakeResp(page), _FakeResp(_PAGE_EMPTY)])
+        )
 
         out, new_offset, seen_map = wp.fetch_since(
             "2025-10-18T17:00:00Z",
@@ -879,119 +996,71 @@ class TestWeatherFetchSinceMaxTsEmission:
 class TestWeatherMainFunction:
     """Tests for the main() function."""
 
-    def test_main_single_iteration_no_data(self, monkeypatch, tmp_path):
+    def test_main_single_iteration_no_data(self, monkeypatch, wp_config):
         """Verifies main loop handles no-data case."""
-        monkeypatch.setattr(wp, "STATE_DIR", str(tmp_path))
-        monkeypatch.setattr(wp, "STATE_JSON", str(tmp_path / "state.json"))
-        monkeypatch.setattr(wp, "OFFSET_FILE", str(tmp_path / "offset.txt"))
-        monkeypatch.setattr(wp, "DLQ_DIR", str(tmp_path / "dlq"))
-        monkeypatch.setattr(wp, "POLL_SECS", 0)
-        monkeypatch.setattr(wp, "START_OFFSET", "1970-01-01T00:00:00Z")
+        monkeypatch.setattr(wp, "http_request_with_retry", _SequencedResponder([_FakeResp(_PAGE_EMPTY)]))
 
-        def fake_http_request(session, method, url, **kwargs):
-            return _FakeResp({"results": []})
-
-        monkeypatch.setattr(wp, "http_request_with_retry", fake_http_request)
-
-        class MockProducer:
-            def produce(self, topic, key, value, callback=None):
-                pass
-
-            def flush(self, timeout=None):
-                return 0
-
-        monkeypatch.setattr("confluent_kafka.Producer", lambda cfg: MockProducer())
-
-        original_running = wp.running
-        monkeypatch.setattr(wp, "running", False)
+        monkeypatch.setattr(wp, "Producer", _MockKafkaProducer)
 
         wp.main()
 
-        wp.running = original_running
-
-    def test_main_with_data_produces_messages(self, monkeypatch, tmp_path, capsys):
+    def test_main_with_data_produces_messages(self, monkeypatch, wp_config, capsys):
         """Verifies main loop produces messages when data is available."""
-        monkeypatch.setattr(wp, "STATE_DIR", str(tmp_path))
-        monkeypatch.setattr(wp, "STATE_JSON", str(tmp_path / "state.json"))
-        monkeypatch.setattr(wp, "OFFSET_FILE", str(tmp_path / "offset.txt"))
-        monkeypatch.setattr(wp, "DLQ_DIR", str(tmp_path / "dlq"))
-        monkeypatch.setattr(wp, "POLL_SECS", 0)
-        monkeypatch.setattr(wp, "START_OFFSET", "1970-01-01T00:00:00Z")
-        monkeypatch.setattr(wp, "LIMIT", 10)
-
-        page = {
-            "results": [
-                {
-                    "fiwareid": "W01",
-                    "fecha_carg": "2025-10-18T18:00:00+00:00",
-                    "temperatur": 22.5,
-                    "geo_point_2d": {"lat": 39.47, "lon": -0.38},
-                }
-            ]
-        }
-        meta = {"dataset": {"fields": [{"name": "fiwareid"}, {"name": "fecha_carg"}, {"name": "temperatur"}]}}
-
-        call_count = [0]
-
-        def fake_http_request(session, method, url, **kwargs):
-            call_count[0] += 1
-            if "/records" not in url:
-                return _FakeResp(meta)
-            if call_count[0] <= 2:
-                return _FakeResp(page)
-            return _FakeResp({"results": []})
-
-        monkeypatch.setattr(wp, "http_request_with_retry", fake_http_request)
-
-        class MockProducer:
-            def produce(self, topic, key, value, callback=None):
-                if callback:
-                    callback(None, type("Msg", (), {"key": lambda: key, "value": lambda: value})())
-
-            def flush(self, timeout=None):
-                return 0
-
-        monkeypatch.setattr("confluent_kafka.Producer", lambda cfg: MockProducer())
+        responder = _SequencedResponder(
+            [_FakeResp(_PAGE_W01_LATER), _FakeResp(_PAGE_EMPTY)], routes={_META_URL_RX: _FakeResp(_METADATA_FIELDS)}
+        )
+        monkeypatch.setattr(wp, "http_request_with_retry", responder)
 
-        original_running = wp.running
-        monkeypatch.setattr(wp, "running", False)
+        monkeypatch.setattr(wp, "Producer", _MockKafkaProducer)
 
         wp.main()
 
         captured = capsys.readouterr()
         assert "[weather] using ts_field" in captured.out
 
-        wp.running = original_running
+    def test_main_produce_pass_serves_delivery_reports(self, monkeypatch, wp_config, capsys):
+        """Verifies one produce pass drains the batched delivery reports before saving state."""
+        responder = _SequencedResponder(
+            [_FakeResp(_PAGE_W01_LATER), _FakeResp(_PAGE_EMPTY)], routes={_META_URL_RX: _FakeResp(_METADATA_FIELDS)}
+        )
+        monkeypatch.setattr(wp, "http_request_with_retry", responder)
+        monkeypatch.setattr(wp, "JSONSerializer", lambda schema_str, client: mock_serializer)
+        producers: List[_MockKafkaProducer] = []
 
-    def test_main_handles_exception_gracefully(self, monkeypatch, tmp_path):
-        """Verifies main loop catches and logs exceptions."""
-        monkeypatch.setattr(wp, "STATE_DIR", str(tmp_path))
-        monkeypatch.setattr(wp, "STATE_JSON", str(tmp_path / "state.json"))
-        monkeypatch.setattr(wp, "OFFSET_FILE", str(tmp_path / "offset.txt"))
-        monkeypatch.setattr(wp, "DLQ_DIR", str(tmp_path / "dlq"))
-        monkeypatch.setattr(wp, "POLL_SECS", 0)
-        monkeypatch.setattr(wp, "START_OFFSET", "1970-01-01T00:00:00Z")
+        def make_producer(config):
+            producers.append(_MockKafkaProducer(config))
+            return producers[-1]
 
-        def fake_http_request(session, method, url, **kwargs):
-            raise RuntimeError("Simulated failure")
+        monkeypatch.setattr(wp, "Producer", make_producer)
+        saved = []
+        real_save_state = wp.save_state
 
-        monkeypatch.setattr(wp, "http_request_with_retry", fake_http_request)
+        def save_state_then_stop(offset_iso, seen_map):
+            # Every report must have been served by now; stopping after the first pass
+            saved.append((offset_iso, len(producers[0])))
+            real_save_state(offset_iso, seen_map)
+            monkeypatch.setattr(wp, "running", False)
 
-        class MockProducer:
-            def produce(self, topic, key, value, callback=None):
-                pass
+        monkeypatch.setattr(wp, "save_state", save_state_then_stop)
+        monkeypatch.setattr(wp, "running", True)
 
-            def flush(self, timeout=None):
-                return 0
+        wp.main()
 
-        monkeypatch.setattr("confluent_kafka.Producer", lambda cfg: MockProducer())
+        raw = producers[0]
+        assert raw.keys == [b"W01|2025-10-18T18:00:00Z"]
+        assert saved == [("2025-10-18T18:00:00Z", 0)]
+        # The drain loop polled the report in; the final flush found nothing left
+        assert raw.polls >= 1
+        assert raw.flushes == 1
+        assert "produced 1; offset=2025-10-18T18:00:00Z; seen=1 (ok=1, fail=0)" in capsys.readouterr().out
 
-        original_running = wp.running
-        monkeypatch.setattr(wp, "running", False)
+    def test_main_handles_exception_gracefully(self, monkeypatch, wp_config):
+        """Verifies main loop catches and logs exceptions."""
+        monkeypatch.setattr(wp, "http_request_with_retry", _SequencedResponder([RuntimeError("Simulated failure")]))
 
-        wp.main()
+        monkeypatch.setattr(wp, "Producer", _MockKafkaProducer)
 
-        wp.running = original_running
+        wp.main()
 
 
 class TestWeatherStopHandler:
@@ -1002,4 +1071,3 @@ class TestWeatherStopHandler:
         monkeypatch.setattr(wp, "running", True)
         wp._stop()
         assert wp.running is False
-        wp.running = True
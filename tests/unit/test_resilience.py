@@ -1,16 +1,13 @@
 """Unit tests for producer resilience module."""
 
-import sys
 import time
-from pathlib import Path
+from datetime import datetime, timedelta, timezone
+from email.utils import format_datetime
 from unittest.mock import MagicMock
 
 import pytest
 import requests
-
-# Make producer modules importable
-sys.path.append(str(Path(__file__).parents[2] / "producer"))
-from resilience import (  # noqa: E402
+from resilience import (
     DiskQueue,
     ExponentialBackoff,
     InflightLimiter,
@@ -18,12 +15,30 @@ from resilience import (  # noqa: E402
     RateThrottler,
     ResilientProducer,
     RetryConfig,
+    _retry_after_secs,
     http_request_with_retry,
     is_retryable_error,
     is_retryable_status,
+    make_http_session,
 )
 
 
+class _FakeMsg:
+    """Minimal confluent_kafka.Message for delivery callbacks."""
+
+    __slots__ = ("_k", "_v")
+
+    def __init__(self, k: bytes, v: bytes):
+        self._k = k
+        self._v = v
+
+    def key(self) -> bytes:
+        return self._k
+
+    def value(self) -> bytes:
+        return self._v
+
+
 class TestRetryConfig:
     """Tests for RetryConfig dataclass."""
 
@@ -212,6 +227,45 @@ class TestHttpRequestWithRetry:
         # Verifying we slept for 2 seconds as per Retry-After
         assert 2 in sleep_calls
 
+    @pytest.mark.parametrize(
+        "header,expected",
+        [
+            ("2", 2),
+            ("Wed, 21 Oct 2015 07:28:00 GMT", 0.0),  # HTTP-date in the past: retry immediately
+            ("-1", None),
+            ("²", None),  # Unicode digit that int() rejects
+            ("soon", None),
+            ("", None),
+            (None, None),
+        ],
+    )
+    def test_retry_after_parsing(self, header, expected):
+        """Verifies delay-seconds and HTTP-date forms parse, and anything else defers to backoff."""
+        assert _retry_after_secs(header) == expected
+
+    def test_retry_after_capped_at_max_delay(self, monkeypatch):
+        """Verifies a far-future Retry-After sleeps no longer than max_delay_ms."""
+        sleep_calls = []
+        monkeypatch.setattr(time, "sleep", lambda x: sleep_calls.append(x))
+        session = MagicMock()
+        fail_resp = MagicMock()
+        fail_resp.status_code = 503
+        fail_resp.headers = {
+            "Retry-After": format_datetime(datetime.now(timezone.utc) + timedelta(hours=6), usegmt=True)
+        }
+        success_resp = MagicMock()
+        success_resp.status_code = 200
+        session.request.side_effect = [fail_resp, success_resp]
+        config = RetryConfig(max_retries=3, max_delay_ms=5000, jitter_factor=0)
+        http_request_with_retry(session, "GET", "http://test.com", config)
+        assert sleep_calls == [5.0]
+
+    def test_retry_after_http_date_in_future(self):
+        """Verifies an HTTP-date Retry-After waits until that moment."""
+        when = datetime.now(timezone.utc) + timedelta(seconds=30)
+        wait = _retry_after_secs(format_datetime(when, usegmt=True))
+        assert 28 <= wait <= 30
+
     def test_non_retryable_error_raises_immediately(self):
         """Verifies non-retryable errors raise without retry."""
         session = MagicMock()
@@ -222,6 +276,30 @@ class TestHttpRequestWithRetry:
         assert session.request.call_count == 1
 
 
+class TestMakeHttpSession:
+    """Tests for make_http_session."""
+
+    def test_mounts_pooled_adapter_without_retries(self):
+        """Verifies the session pools connections and leaves retries to http_request_with_retry."""
+        session = make_http_session("test-agent/1.0", pool_maxsize=8)
+        assert session.headers["User-Agent"] == "test-agent/1.0"
+        for prefix in ("http://", "https://"):
+            adapter = session.get_adapter(f"{prefix}example.com")
+            assert adapter._pool_maxsize == 8
+            assert adapter.max_retries.total == 0
+
+    def test_applies_default_timeout_only_when_unset(self, monkeypatch):
+        """Verifies the adapter fills in the session timeout but keeps an explicit one."""
+        sent = []
+        monkeypatch.setattr(requests.adapters.HTTPAdapter, "send", lambda self, request, **kw: sent.append(kw))
+        session = make_http_session("test-agent/1.0", timeout=(3, 7))
+        adapter = session.get_adapter("https://example.com")
+        request = requests.Request("GET", "https://example.com").prepare()
+        adapter.send(request, timeout=None)
+        adapter.send(request, timeout=1)
+        assert [kw["timeout"] for kw in sent] == [(3, 7), 1]
+
+
 class TestInflightLimiter:
     """Tests for InflightLimiter concurrency control."""
 
@@ -295,6 +373,58 @@ class TestDiskQueue:
         # Should get 2 valid messages, skip malformed
         assert len(messages) == 2
 
+    def test_enqueue_many_batches_in_order(self, tmp_path):
+        """Verifies a batch enqueue is counted and replayed in order after the existing entries."""
+        queue = DiskQueue(str(tmp_path), topic="test")
+        queue.enqueue(b"key0", b"value0")
+        assert queue.enqueue_many([(b"key1", b"value1"), (b"key2", b"value2")]) == 2
+        assert queue.enqueue_many([]) == 0
+        assert queue.size() == 3
+        assert [k for k, _ in queue.dequeue_all()] == [b"key0", b"key1", b"key2"]
+
+    def test_binary_values_round_trip(self, tmp_path):
+        """Verifies non-UTF-8 payloads (e.g. Schema Registry framing) survive byte-for-byte."""
+        queue = DiskQueue(str(tmp_path), topic="test")
+        value = b"\x00\x00\x00\x00\xff{}"
+        queue.enqueue(b"k\x80", value)
+        assert queue.dequeue_all() == [(b"k\x80", value)]
+
+    def test_skips_corrupt_and_torn_frames(self, tmp_path):
+        """Verifies a CRC mismatch skips one frame and a partially written tail is dropped."""
+        queue = DiskQueue(str(tmp_path), topic="test")
+        for i in range(3):
+            queue.enqueue(f"key{i}".encode(), f"value{i}".encode())
+        queue.close()
+        queue_file = tmp_path / "test.dlq"
+        data = bytearray(queue_file.read_bytes())
+        frame_len = len(data) // 3
+        data[frame_len + frame_len - 1] ^= 0xFF  # flip a byte in the middle frame's value
+        queue_file.write_bytes(bytes(data[:-2]))  # truncate the last frame
+        assert queue.dequeue_all() == [(b"key0", b"value0")]
+
+    def test_enqueue_after_torn_tail_is_readable(self, tmp_path):
+        """Verifies a restart trims a partial final frame so later enqueues are not swallowed by it."""
+        queue = DiskQueue(str(tmp_path), topic="test")
+        queue.enqueue(b"k0", b"v0")
+        queue.close()
+        queue_file = tmp_path / "test.dlq"
+        queue_file.write_bytes(queue_file.read_bytes() + b"\x01\x02\x03\x04\x05\x06")
+        queue = DiskQueue(str(tmp_path), topic="test")
+        assert queue.size() == 1
+        queue.enqueue(b"k1", b"v1")
+        queue.enqueue(b"k2", b"v2")
+        assert queue.size() == 3
+        assert queue.dequeue_all() == [(b"k0", b"v0"), (b"k1", b"v1"), (b"k2", b"v2")]
+
+    def test_size_counts_queue_left_by_previous_run(self, tmp_path):
+        """Verifies a new instance counts messages already on disk, legacy lines included."""
+        DiskQueue(str(tmp_path), topic="test").enqueue(b"key", b"value")
+        (tmp_path / "test.jsonl").write_text('{"key": "k", "value": "v"}\n', encoding="utf-8")
+        queue = DiskQueue(str(tmp_path), topic="test")
+        assert queue.size() == 2
+        assert queue.dequeue_all() == [(b"k", b"v"), (b"key", b"value")]
+        assert queue.size() == 0
+
 
 class TestProduceStats:
     """Tests for ProduceStats tracking."""
@@ -337,14 +467,29 @@ class TestProduceStats:
         stats.record_success()
         stats.record_failure()
         assert stats.total == 2
-        # Simulating time passage
-        original_time = time.time
-        monkeypatch.setattr(time, "time", lambda: original_time() + 2)
+        # Simulating time passage on the monotonic clock
+        original_ns = time.monotonic_ns
+        monkeypatch.setattr(time, "monotonic_ns", lambda: original_ns() + 2_000_000_000)
         stats.record_success()
         # Window should have reset
         assert stats.success_count == 1
         assert stats.failure_count == 0
 
+    def test_window_slides_per_second(self, monkeypatch):
+        """Verifies only buckets older than the window are evicted, and wall-clock jumps are ignored."""
+        now_ns = [1_000 * 1_000_000_000]
+        monkeypatch.setattr(time, "monotonic_ns", lambda: now_ns[0])
+        stats = ProduceStats(window_seconds=3)
+        stats.record_failure()
+        now_ns[0] += 2_000_000_000
+        stats.record_success()
+        monkeypatch.setattr(time, "time", lambda: 0.0)
+        assert stats.total == 2
+        # The failure's bucket ages out; the success two seconds later stays
+        now_ns[0] += 1_000_000_000
+        assert stats.failure_count == 0
+        assert stats.success_count == 1
+
 
 class TestRateThrottler:
     """Tests for RateThrottler rate limiting."""
@@ -388,6 +533,50 @@ class TestResilientProducer:
         assert call_kwargs["key"] == b"key"
         assert call_kwargs["value"] == b"value"
 
+    def test_produce_polls_and_retries_when_queue_full(self, tmp_path):
+        """Verifies a full local queue is drained via poll() before the produce is retried."""
+        mock_producer = MagicMock()
+        mock_producer.produce.side_effect = [BufferError("Local: Queue full"), None]
+        rp = ResilientProducer(mock_producer, "test-topic", str(tmp_path))
+        rp.produce(b"key", b"value")
+        assert mock_producer.produce.call_count == 2
+        mock_producer.poll.assert_called_once_with(0.1)
+
+    def test_produce_spills_to_dlq_when_queue_stays_full(self, tmp_path):
+        """Verifies a queue that stays full past queue_full_timeout sends the message to the DLQ instead of spinning."""
+        mock_producer = MagicMock()
+        mock_producer.produce.side_effect = BufferError("Local: Queue full")
+        rp = ResilientProducer(mock_producer, "test-topic", str(tmp_path), queue_full_timeout=0)
+        rp.produce(b"key", b"value")
+        assert rp.dlq_size == 1
+        assert rp._pending == {}
+
+    def test_produce_many_spills_rest_of_batch_once_queue_stays_full(self, tmp_path):
+        """Verifies the unsent remainder of a batch returns to the DLQ without waiting per message."""
+        mock_producer = MagicMock()
+        mock_producer.produce.side_effect = [None] + [BufferError("Local: Queue full")] * 2
+        rp = ResilientProducer(mock_producer, "test-topic", str(tmp_path), queue_full_timeout=0)
+        sent = rp.produce_many([(b"key1", b"value1"), (b"key2", b"value2"), (b"key3", b"value3")])
+        assert sent == 1
+        assert mock_producer.produce.call_count == 3
+        assert rp._dlq.dequeue_all() == [(b"key2", b"value2"), (b"key3", b"value3")]
+        assert list(rp._pending.values()) == [(b"key1", b"value1")]
+
+    def test_poll_serves_delivery_reports(self, tmp_path):
+        """Verifies poll delegates to the underlying producer without blocking by default."""
+        mock_producer = MagicMock()
+        mock_producer.poll.return_value = 3
+        rp = ResilientProducer(mock_producer, "test-topic", str(tmp_path))
+        assert rp.poll() == 3
+        mock_producer.poll.assert_called_once_with(0)
+
+    def test_outstanding_reports_local_queue_length(self, tmp_path):
+        """Verifies outstanding reads the underlying producer's queue length."""
+        mock_producer = MagicMock()
+        mock_producer.__len__.return_value = 4
+        rp = ResilientProducer(mock_producer, "test-topic", str(tmp_path))
+        assert rp.outstanding == 4
+
     def test_delivery_failure_queues_to_dlq(self, tmp_path):
         """Verifies failed delivery queues message to DLQ."""
         mock_producer = MagicMock()
@@ -396,12 +585,9 @@ class TestResilientProducer:
         rp.produce(b"key", b"value")
         # Simulating delivery callback with error
         callback = mock_producer.produce.call_args[1]["callback"]
-        mock_msg = MagicMock()
-        mock_msg.key.return_value = b"key"
-        mock_msg.value.return_value = b"value"
         mock_error = MagicMock()
         mock_error.__str__ = lambda self: "Broker unavailable"
-        callback(mock_error, mock_msg)
+        callback(mock_error, _FakeMsg(b"key", b"value"))
         # Verifying message was queued to DLQ
         assert rp.dlq_size == 1
 
@@ -412,12 +598,21 @@ class TestResilientProducer:
         rp.produce(b"key", b"value")
         # Simulating successful delivery callback
         callback = mock_producer.produce.call_args[1]["callback"]
-        mock_msg = MagicMock()
-        mock_msg.key.return_value = b"key"
-        mock_msg.value.return_value = b"value"
-        callback(None, mock_msg)
+        callback(None, _FakeMsg(b"key", b"value"))
         assert rp.stats.success_count == 1
 
+    def test_bulk_delivery_reports_clear_pending(self, tmp_path):
+        """Verifies a large batch of successful delivery reports clears every pending message."""
+        mock_producer = MagicMock()
+        rp = ResilientProducer(mock_producer, "test-topic", str(tmp_path))
+        messages = [(f"key{i}".encode(), f"value{i}".encode()) for i in range(1000)]
+        rp.produce_many(messages)
+        callback = mock_producer.produce.call_args[1]["callback"]
+        for key, value in messages:
+            callback(None, _FakeMsg(key, value))
+        assert rp._pending == {}
+        assert rp.stats.success_count == 1000
+
     def test_retry_dlq(self, tmp_path):
         """Verifies retry_dlq reads and re-produces messages."""
         mock_producer = MagicMock()
@@ -429,6 +624,18 @@ class TestResilientProducer:
         assert count == 2
         assert mock_producer.produce.call_count == 2
 
+    def test_produce_many_throttles_once_per_batch(self, tmp_path, monkeypatch):
+        """Verifies a batch is tracked per message but checks the throttle only once."""
+        mock_producer = MagicMock()
+        rp = ResilientProducer(mock_producer, "test-topic", str(tmp_path))
+        throttle_calls = []
+        monkeypatch.setattr(rp._throttler, "maybe_throttle", lambda: throttle_calls.append(1))
+        assert rp.produce_many([(b"key1", b"value1"), (b"key2", b"value2")]) == 2
+        assert rp.produce_many([]) == 0
+        assert mock_producer.produce.call_count == 2
+        assert len(rp._pending) == 2
+        assert throttle_calls == [1]
+
     def test_flush_timeout_queues_pending(self, tmp_path):
         """Verifies flush timeout queues pending messages to DLQ."""
         mock_producer = MagicMock()